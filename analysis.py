@@ -1,13 +1,20 @@
 #!/usr/bin/env python3.8
 # coding=utf-8
+from __future__ import annotations
 
-from matplotlib import pyplot as plt
 import pandas as pd
-import seaborn as sns
 import numpy as np
 import os
 import re
 
+from typing import TYPE_CHECKING
+
+from instrument import Instrumentation, DISABLED as INSTRUMENTATION_DISABLED
+from download import DataDownloader
+
+if TYPE_CHECKING:
+    from matplotlib import pyplot as plt
+
 
 # muzete pridat libovolnou zakladni knihovnu ci knihovnu predstavenou na prednaskach
 # dalsi knihovny pak na dotaz
@@ -34,9 +41,11 @@ def _optimize_dataframe_size(dataframe: pd.DataFrame) -> pd.DataFrame:
                              'p34', 'p35', 'p39', 'p44', 'p45a', 'p47', 'p48a', 'p49', 'p50a', 'p50b', 'p51', 'p52',
                              'p53', 'p55a', 'p57', 'p58', 'h', 'i', 'j', 'k', 'l', 'n', 'o', 'p', 'q', 'r', 's', 't',
                              'p5a']
-    # add date to dataframe
-    dates = pd.to_datetime(dataframe['p2a'])
-    dataframe['date'] = dates
+    # add date to dataframe, dates from downloader are already parsed
+    if pd.api.types.is_datetime64_any_dtype(dataframe['p2a']):
+        dataframe['date'] = dataframe['p2a']
+    else:
+        dataframe['date'] = pd.to_datetime(dataframe['p2a'])
 
     # remove unnecessary columns
     dataframe = dataframe.drop(columns=columns_to_drop)
@@ -47,29 +56,64 @@ def _optimize_dataframe_size(dataframe: pd.DataFrame) -> pd.DataFrame:
     return dataframe
 
 
+def _prepare_dataframe(dataframe: pd.DataFrame, verbose: bool,
+                       instrumentation: Instrumentation = INSTRUMENTATION_DISABLED) -> pd.DataFrame:
+    """Optimize size of loaded dataframe and in verbose mode print old and new size"""
+    if verbose:
+        _print_dataframe_size('orig_size', dataframe)
+
+    # optimize dataset size
+    with instrumentation.span('optimize_dataframe_size'):
+        dataframe = _optimize_dataframe_size(dataframe)
+
+    if verbose:
+        _print_dataframe_size('new_size', dataframe)
+    return dataframe
+
+
 # Ukol 1: nacteni dat
-def get_dataframe(filename: str = "accidents.pkl.gz", verbose: bool = False) -> pd.DataFrame:
+def get_dataframe(filename: str = "accidents.pkl.gz", verbose: bool = False,
+                  instrumentation: Instrumentation = None) -> pd.DataFrame:
     """Read dataframe from provided file, optimize size and in verbose mode print old and new size"""
+    instrumentation = instrumentation or INSTRUMENTATION_DISABLED
 
     # provided filename does not exist, we raise os error
     _check_if_path_exist(filename)
 
     # load dataframe from pickle with auto decompression
-    dataframe = pd.read_pickle(filename)
+    with instrumentation.span('read_pickle'):
+        dataframe = pd.read_pickle(filename)
+    instrumentation.count('bytes_in', os.path.getsize(filename))
+    instrumentation.count('rows', dataframe.shape[0])
+    return _prepare_dataframe(dataframe, verbose, instrumentation)
 
-    if verbose:
-        _print_dataframe_size('orig_size', dataframe)
 
-    # optimize dataset size
-    dataframe = _optimize_dataframe_size(dataframe)
+def get_dataframe_from_service(client, verbose: bool = False) -> pd.DataFrame:
+    """Get dataframe from running service.QueryService instead of file, optimize size same as get_dataframe"""
+    dataframe = client.dataframe()
+    return _prepare_dataframe(dataframe, verbose)
+
+
+def get_dataframe_from_downloader(downloader: DataDownloader, regions: list = None, date_range: tuple = None,
+                                  filters: dict = None, verbose: bool = False) -> pd.DataFrame:
+    """Get dataframe from downloader, partitions which could not match date range and filters are not loaded"""
+    labels, values = downloader.get_list(regions, date_range, filters)
+    dataframe = pd.DataFrame(dict(zip(labels, values)))
+    return _prepare_dataframe(dataframe, verbose)
 
-    if verbose:
-        _print_dataframe_size('new_size', dataframe)
-    return dataframe
+
+def get_sample_dataframe(downloader: DataDownloader, regions: list = None, fraction: float = 0.1,
+                         verbose: bool = False) -> pd.DataFrame:
+    """Get stratified sample from downloader as dataframe, column scale holds scale-up factor of each row"""
+    labels, values = downloader.get_sample(regions, fraction)
+    dataframe = pd.DataFrame(dict(zip(labels, values)))
+    return _prepare_dataframe(dataframe, verbose)
 
 
 def _set_axis_content(ax: plt.axis, data: pd.DataFrame, label: str, order: pd.Index):
     """Create modified barplot for column of dataset"""
+    import seaborn as sns
+
     sns.barplot(x=data.index, y=data.value, data=data, ax=ax, palette="flare",
                 order=order)
     ax.tick_params(bottom=False)
@@ -98,18 +142,50 @@ def _save_show_fig(fig_location: str, show_figure: bool, fig: plt.Figure):
         fig.show()
 
 
+# columns with consequences of accidents
+_conseq_columns = ['p13a', 'p13b', 'p13c']
+
+
 # Ukol 2: následky nehod v jednotlivých regionech
 def plot_conseq(df: pd.DataFrame, fig_location: str = None,
                 show_figure: bool = False):
     """Plot graphs showing consequences of accidents in Czech regions"""
-    columns = ['p13a', 'p13b', 'p13c']
-    labels = {'p13a': 'Počet umrtí', 'p13b': 'Počet těžkých zranění', 'p13c': 'Počet lehkých zranění',
-              'all': 'Celkem nehod'}
+    weights = DataDownloader.get_row_weights(df)
+    df = df.assign(**{column: df[column].astype('int') * weights for column in _conseq_columns})
+    accidents_count = pd.Series(weights, index=df.index).groupby(df['region'], observed=True).sum().rename('region')
 
     # aggregate data
-    df_melted = pd.melt(df, id_vars=['region'], value_vars=columns)
+    df_melted = pd.melt(df, id_vars=['region'], value_vars=_conseq_columns)
     df_groups = df_melted.groupby(['variable', 'region']).sum()
-    accidents_count = df['region'].value_counts()
+    _plot_conseq_aggregated(df_groups, accidents_count, fig_location, show_figure)
+
+
+def plot_conseq_chunks(chunks, fig_location: str = None,
+                       show_figure: bool = False):
+    """Plot same graphs as plot_conseq from iterator of chunks tuple(region, year, columns)"""
+    sums = {}
+    counts = {}
+    for region, _, columns in chunks:
+        # rows are counted from column needed by reducer, region is already known from chunk
+        counts[region] = counts.get(region, 0) + len(columns[_conseq_columns[0]])
+        for column in _conseq_columns:
+            # sum in int64, source columns are int8
+            sums[(column, region)] = sums.get((column, region), 0) + int(columns[column].sum(dtype='i8'))
+
+    df_groups = pd.DataFrame([(column, region, value) for (column, region), value in sums.items()],
+                             columns=['variable', 'region', 'value']).set_index(['variable', 'region'])
+    accidents_count = pd.Series(counts, name='region')
+    _plot_conseq_aggregated(df_groups, accidents_count, fig_location, show_figure)
+
+
+def _plot_conseq_aggregated(df_groups: pd.DataFrame, accidents_count: pd.Series, fig_location: str,
+                            show_figure: bool):
+    """Plot consequences from sums indexed by (variable, region) and accident counts indexed by region"""
+    from matplotlib import pyplot as plt
+
+    columns = _conseq_columns
+    labels = {'p13a': 'Počet umrtí', 'p13b': 'Počet těžkých zranění', 'p13c': 'Počet lehkých zranění',
+              'all': 'Celkem nehod'}
     order = accidents_count.sort_values(ascending=False).index
 
     # Set up the matplotlib figure
@@ -127,37 +203,32 @@ def plot_conseq(df: pd.DataFrame, fig_location: str = None,
 
 def _clean_values(df: pd.DataFrame) -> pd.DataFrame:
     """Clean dataframe from unexpected values"""
-    df_cleaned = df[(df['p12'] == 100) | ((df['p12'] >= 201) & (df['p12'] <= 209)) | (
-            (df['p12'] >= 301) & (df['p12'] <= 311)) | (
-                            (df['p12'] >= 401) & (df['p12'] <= 414)) | (
-                            (df['p12'] >= 501) & (df['p12'] <= 516)) | (
-                            (df['p12'] >= 601) & (df['p12'] <= 615))]
-    return df_cleaned[df_cleaned['p53'] >= 0]
+    return df[DataDownloader.get_frame_valid_mask(df, ['p12', 'p53'])]
 
 
 # Ukol3: příčina nehody a škoda
 def plot_damage(df: pd.DataFrame, fig_location: str = None,
                 show_figure: bool = False):
     """Plot graphs showing damage consequences of group of accidents in Czech regions"""
+    import seaborn as sns
+
     regions = ['JHM', 'HKK', 'PLK', 'MSK']
     labels_cause = ['nezaviněná řidičem', 'nepřiměřená rychlost jízdy', 'nesprávné předjíždění',
                     'nedání přednosti v jízdě',
                     'nesprávný způsob jízdy', 'technická závada vozidla']
     labels_damage = ['<50', '50 - 200', '200 - 500', '500 - 1000', '>1000']
     columns = ['region', 'p53', 'p12']
-    # select only interesting columns
-    df_regions = df[df['region'].isin(regions)][columns]
+    # clean data from random values and select only interesting columns
+    df_regions = _clean_values(df[df['region'].isin(regions)])
+    df_regions = df_regions[columns].assign(size=DataDownloader.get_row_weights(df_regions))
 
     df_regions['p12'] = df_regions['p12'].astype('int')
     df_regions['p53'] = df_regions['p53'].astype('int')
 
-    # clean data from random values, if necessary
-    df_regions = _clean_values(df_regions)
-
     df_regions['p12'] = pd.cut(df_regions['p12'], [99, 199, 299, 399, 499, 599, 699], labels=labels_cause)
     df_regions['p53'] = pd.cut(df_regions['p53'], bins=[-np.inf, 500, 2000, 5000, 10000, np.inf],
                                labels=labels_damage)
-    df_regions = df_regions.groupby(columns, as_index=False).size()
+    df_regions = df_regions.groupby(columns, as_index=False)['size'].sum()
 
     # plot values
     sns.set_style("darkgrid")
@@ -174,31 +245,75 @@ def plot_damage(df: pd.DataFrame, fig_location: str = None,
     _save_show_fig(fig_location, show_figure, g.fig)
 
 
+# regions and labels of road condition used in plot_surface
+_surface_regions = ['JHM', 'HKK', 'PLK', 'MSK']
+_surface_labels = {0: 'jiný stav', 1: 'suchý neznečištěný', 2: 'suchý znečištěný', 3: 'mokrý', 4: 'bláto',
+                   5: 'náledí, ujetý sníh - posypané', 6: 'náledí, ujetý sníh - neposypané',
+                   7: 'rozlitý olej, nafta apod.', 8: 'souvislý sníh', 9: 'náhlá změna stavu'}
+
+
 # Ukol 4: povrch vozovky
 def plot_surface(df: pd.DataFrame, fig_location: str = None,
                  show_figure: bool = False):
     """Plot graphs showing accidents according to road condition in Czech regions"""
-    regions = ['JHM', 'HKK', 'PLK', 'MSK']
-    columns = ['region', 'date', 'p16']
-    labels = {0: 'jiný stav', 1: 'suchý neznečištěný', 2: 'suchý znečištěný', 3: 'mokrý', 4: 'bláto',
-              5: 'náledí, ujetý sníh - posypané', 6: 'náledí, ujetý sníh - neposypané', 7: 'rozlitý olej, nafta apod.',
-              8: 'souvislý sníh', 9: 'náhlá změna stavu'}
-
-    # filter only needed values
-    df_surface = df[df['region'].isin(regions)][columns]
+    # month index precomputed by downloader is used if present, so dates are not grouped again
+    time_column = 'month' if 'month' in df else 'date'
+    columns = ['region', time_column, 'p16']
 
-    # clean from unexpected values
+    # filter only needed values and clean from unexpected values
+    df_surface = df[df['region'].isin(_surface_regions) & DataDownloader.get_frame_valid_mask(df, ['p16'])]
+    df_surface = df_surface[columns].assign(weight=DataDownloader.get_row_weights(df_surface))
     df_surface['p16'] = df_surface['p16'].astype('int')
-    df_surface = df_surface[(df_surface['p16'] >= 0) & (df_surface['p16'] <= 9)]
 
     # create crosstab and rename columns
-    df_surface = pd.crosstab([df_surface['region'], df_surface['date']], [df_surface['p16']])
-    df_surface.rename(columns=labels, inplace=True)
+    df_surface = pd.crosstab([df_surface['region'], df_surface[time_column]], [df_surface['p16']],
+                             values=df_surface['weight'], aggfunc='sum').fillna(0)
+    df_surface.rename(columns=_surface_labels, inplace=True)
+
+    if time_column == 'month':
+        df_grouped = df_surface
+        df_grouped.index = _month_index_to_dates(df_grouped.index)
+    else:
+        # group by region and month and sum values
+        df_grouped = df_surface.groupby([pd.Grouper(level='region'),
+                                         pd.Grouper(level='date', freq='M')]
+                                        ).sum()
+    _plot_surface_aggregated(df_grouped, fig_location, show_figure)
+
+
+def plot_surface_chunks(chunks, fig_location: str = None,
+                        show_figure: bool = False):
+    """Plot same graphs as plot_surface from iterator of chunks tuple(region, year, columns)"""
+    counts = None
+    for region, _, columns in chunks:
+        if region not in _surface_regions:
+            continue
+        # clean from unexpected values
+        p16 = columns['p16']
+        mask = DataDownloader.get_valid_mask(columns['valid'], ['p16'])
+        chunk_counts = pd.DataFrame({'region': region, 'month': columns['month'][mask],
+                                     'p16': p16[mask].astype('int')}).value_counts()
+        counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+    if counts is None:
+        raise ValueError(f'Provided chunks do not contain any of regions {_surface_regions}')
+
+    df_grouped = counts.astype('int').unstack('p16', fill_value=0).sort_index()
+    df_grouped.index = _month_index_to_dates(df_grouped.index)
+    df_grouped.rename(columns=_surface_labels, inplace=True)
+    _plot_surface_aggregated(df_grouped, fig_location, show_figure)
+
+
+def _month_index_to_dates(index: pd.MultiIndex) -> pd.MultiIndex:
+    """Replace level month holding months since 1970-01 by last day of month, same as pd.Grouper with freq='M'"""
+    months = index.get_level_values('month').to_numpy().astype('i8').astype('datetime64[M]')
+    dates = ((months + 1).astype('datetime64[D]') - 1).astype('datetime64[ns]')
+    return pd.MultiIndex.from_arrays([index.get_level_values('region'), dates], names=['region', 'date'])
+
+
+def _plot_surface_aggregated(df_grouped: pd.DataFrame, fig_location: str, show_figure: bool):
+    """Plot accident counts indexed by (region, month) with road condition in columns"""
+    import seaborn as sns
 
-    # group by region and month and sum values
-    df_grouped = df_surface.groupby([pd.Grouper(level='region'),
-                                     pd.Grouper(level='date', freq='M')]
-                                    ).sum()
     df_grouped = df_grouped.stack()
     df_grouped = df_grouped.reset_index()
 
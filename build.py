@@ -0,0 +1,24 @@
+from argparse import ArgumentParser
+from download import DataDownloader
+from instrument import Instrumentation
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Build cache files cooperatively with other workers sharing data folder.')
+    parser.add_argument('--folder', type=str, default='data',
+                        help='data folder shared by all workers')
+    parser.add_argument('--regions', type=str, nargs='*',
+                        help='regions to build, all regions by default')
+    parser.add_argument('--lease_timeout', type=float, default=600,
+                        help='seconds after which lease of unresponsive worker is reclaimed')
+    parser.add_argument('--offline', action="store_true",
+                        help='use only local datasets, do not check url for new datasets')
+    parser.add_argument('--report', type=str,
+                        help='path where to save json report with timings and counters of processing stages')
+    args = parser.parse_args()
+    instrumentation = Instrumentation(enabled=args.report is not None)
+    print(f'Building cache in folder: {args.folder}...')
+    downloader = DataDownloader(folder=args.folder, instrumentation=instrumentation, offline=args.offline)
+    downloader.build_cache(args.regions or None, args.lease_timeout)
+    print('Cache was successfully built')
+    if args.report:
+        instrumentation.dump(args.report)
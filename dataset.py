@@ -0,0 +1,109 @@
+import numpy as np
+
+from os import path, makedirs
+from shutil import rmtree
+
+
+def _import_pyarrow():
+    """Import pyarrow lazily, it is needed only for columnar dataset export"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError('Columnar dataset requires pyarrow, install it by: pip install pyarrow')
+    return pyarrow
+
+
+def write_partition(folder, region, year, columns, row_group_size=16384):
+    """Write single region and year partition in hive layout folder/region=XXX/year=YYYY/part-0.parquet"""
+    pa = _import_pyarrow()
+    partition_folder = path.join(folder, f'region={region}', f'year={year}')
+    if not path.exists(partition_folder):
+        try:
+            makedirs(partition_folder)
+        except OSError:
+            raise OSError(f'Could not create directory: {partition_folder}')
+
+    # sort rows by date, so statistics of row groups cover narrow date ranges
+    order = np.argsort(columns['p2a'], kind='stable') if 'p2a' in columns else slice(None)
+    # region and year are stored in partition keys
+    table = pa.table({label: pa.array(values[order]) for label, values in columns.items()
+                      if label not in ('region', 'year')})
+    file_path = path.join(partition_folder, 'part-0.parquet')
+    pa.parquet.write_table(table, file_path, row_group_size=row_group_size, write_statistics=True)
+    return file_path
+
+
+def remove_partitions(folder, regions):
+    """Remove all year partitions of provided regions, so partitions left from earlier export are not read"""
+    for region in regions:
+        region_folder = path.join(folder, f'region={region}')
+        if path.exists(region_folder):
+            rmtree(region_folder)
+
+
+def _get_filter_value(value, d_type):
+    """Convert filter value to type comparable with column, dates are accepted as strings same as in get_list"""
+    if np.dtype(d_type).kind != 'M':
+        return value
+    if isinstance(value, list):
+        return [np.datetime64(item, 'D').item() for item in value]
+    return np.datetime64(value, 'D').item()
+
+
+def _get_filter_expression(regions=None, date_range=None, filters=None, d_types=None):
+    """Create pyarrow expression, region and year are partition keys so non matching files are not opened"""
+    pa = _import_pyarrow()
+    field = pa.dataset.field
+    expressions = []
+    if regions is not None:
+        expressions.append(field('region').isin(regions))
+    if date_range is not None:
+        start, end = date_range
+        if start is not None:
+            start = np.datetime64(start, 'D')
+            expressions.append(field('year') >= int(start.astype('datetime64[Y]').astype('i4')) + 1970)
+            expressions.append(field('p2a') >= pa.scalar(start.item(), pa.date32()))
+        if end is not None:
+            end = np.datetime64(end, 'D')
+            expressions.append(field('year') <= int(end.astype('datetime64[Y]').astype('i4')) + 1970)
+            expressions.append(field('p2a') <= pa.scalar(end.item(), pa.date32()))
+    # value is compared for equality, list for membership and dict for range
+    d_types = d_types or {}
+    for column, value in (filters or {}).items():
+        d_type = d_types.get(column, 'O')
+        if isinstance(value, dict):
+            if 'min' in value:
+                expressions.append(field(column) >= _get_filter_value(value['min'], d_type))
+            if 'max' in value:
+                expressions.append(field(column) <= _get_filter_value(value['max'], d_type))
+        elif isinstance(value, list):
+            expressions.append(field(column).isin(_get_filter_value(value, d_type)))
+        else:
+            expressions.append(field(column) == _get_filter_value(value, d_type))
+    if not expressions:
+        return None
+    expression = expressions[0]
+    for item in expressions[1:]:
+        expression = expression & item
+    return expression
+
+
+def read_dataset(folder, headers, columns=None, regions=None, date_range=None, filters=None):
+    """Read partitioned dataset to tuple(list[str], list[np.ndarray]) same as DataDownloader.get_list"""
+    pa = _import_pyarrow()
+    if not path.exists(folder):
+        raise OSError(f'Could not find: {folder}')
+    d_types = {item['label']: item['d_type'] for item in headers}
+    labels = columns or [item['label'] for item in headers]
+    for label in labels:
+        if label not in d_types:
+            raise ValueError(f'Provided column {label} does not exist')
+
+    dataset = pa.dataset.dataset(folder, format='parquet',
+                                 partitioning=pa.dataset.partitioning(
+                                     pa.schema([('region', pa.string()), ('year', pa.int32())]), flavor='hive'))
+    table = dataset.to_table(columns=labels, filter=_get_filter_expression(regions, date_range, filters, d_types))
+    values = [np.asarray(table.column(label).to_numpy()).astype(d_types[label]) for label in labels]
+    return labels, values
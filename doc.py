@@ -1,6 +1,12 @@
+from __future__ import annotations
+
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
+
+from typing import TYPE_CHECKING
+from download import DataDownloader
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
 
 car_types = {1: "ALFA-ROMEO", 2: "AUDI", 3: "AVIA", 4: "BMW", 5: "CHEVROLET", 6: "CHRYSLER", 7: "CITROEN",
              8: "DACIA", 9: "DAEWOO", 10: "DAF", 11: "DODGE", 12: "FIAT", 13: "FORD", 14: "GAZ, VOLHA",
@@ -27,9 +33,28 @@ def save_show_fig(fig_location: str, show_figure: bool, fig: plt.Figure):
         fig.show()
 
 
+def _get_weighted_means(df: pd.DataFrame, by: list, columns: list) -> pd.DataFrame:
+    """Get count of rows and means of columns in groups, rows of stratified sample are weighted by scale"""
+    weights = DataDownloader.get_row_weights(df)
+    df_weighted = df[columns].multiply(weights, axis=0).assign(count=weights)
+    df_grouped = df_weighted.groupby([df[column] for column in by], observed=False).sum()
+    df_grouped[columns] = df_grouped[columns].divide(df_grouped['count'], axis=0)
+    return df_grouped[['count'] + columns]
+
+
 def get_dataset(filename: str) -> pd.DataFrame:
     """Get personal car accidents with filled car brand cleaned from accidents with alcohol or drugs"""
-    df = pd.read_pickle(filename)
+    return _filter_dataset(pd.read_pickle(filename))
+
+
+def get_dataset_from_service(client) -> pd.DataFrame:
+    """Same as get_dataset, but data are received from running service.QueryService"""
+    columns = ['p1', 'p11', 'p13a', 'p13b', 'p13c', 'p44', 'p45a', 'p47', 'valid']
+    return _filter_dataset(client.dataframe(columns))
+
+
+def _filter_dataset(df: pd.DataFrame) -> pd.DataFrame:
+    """Select personal car accidents with filled car brand without alcohol or drugs"""
     print(f'Number of accidents: {df.shape[0]}')
     return df[((df['p11'] == 0) | (df['p11'] == 2)) & ((df['p44'] == 3) | (df['p44'] == 4))].dropna(subset=['p45a'])
 
@@ -37,11 +62,15 @@ def get_dataset(filename: str) -> pd.DataFrame:
 def plot_car_type(df: pd.DataFrame, fig_location: str = None,
                   show_figure: bool = False):
     """Plot bar graph of accidents brand / hurt rate"""
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
     # count every hurt person count in each accident
-    df['hurt'] = df['p13a'] + df['p13b'] + df['p13c']
+    weights = DataDownloader.get_row_weights(df)
+    df['hurt'] = (df['p13a'] + df['p13b'] + df['p13c']) * weights
 
     # group by brand of car and count hurt people and accidents count for each group
-    df_grouped = df.groupby(['p45a']).aggregate({'p1': 'count', 'hurt': 'sum'}).rename(columns={'p1': 'count'})
+    df_grouped = df.assign(count=weights).groupby(['p45a']).aggregate({'count': 'sum', 'hurt': 'sum'})
 
     # remove values that are not known brands
     df_grouped.drop([98, 99, ], inplace=True)
@@ -76,7 +105,7 @@ def create_table_by_year(df: pd.DataFrame):
     """Create latex table with overview of accidents with injury and year of production of car"""
 
     # remove unknown years
-    df = df[df['p47'] != -1]
+    df = df[DataDownloader.get_frame_valid_mask(df, ['p47'])]
     df_clean = df.copy()
 
     # split years to bin
@@ -87,12 +116,11 @@ def create_table_by_year(df: pd.DataFrame):
     find_worst_scenario(df_clean)
     print_stats(df_clean)
     # group and aggregate interesting values
-    df_grouped = df_clean.groupby(['p_year']).aggregate(
-        {'p1': 'count', 'p13a': 'mean', 'p13b': 'mean', 'p13c': 'mean'})
+    df_grouped = _get_weighted_means(df_clean, ['p_year'], ['p13a', 'p13b', 'p13c'])
     df_grouped[['p13a', 'p13b', 'p13c']] = df_grouped[['p13a', 'p13b', 'p13c']].multiply(100)
     # rename columns
     df_grouped = df_grouped.rename(
-        columns={'p_year': 'rok výroby', 'p1': 'počet nehod', 'p13a': 'smrt [%]', 'p13b': 'těžké zranění [%]',
+        columns={'p_year': 'rok výroby', 'count': 'počet nehod', 'p13a': 'smrt [%]', 'p13b': 'těžké zranění [%]',
                  'p13c': 'lehké zranění [%]'})
 
     # create latex table and print it to stdout
@@ -103,8 +131,8 @@ def find_worst_scenario(df: pd.DataFrame):
     """Find cars u don't want to sit in :)"""
     # aggregate and clean data
     df['hurt'] = df['p13a'] + df['p13b'] + df['p13c']
-    df_grouped = df.groupby(['p45a', 'p_year']).aggregate({'p1': 'count', 'hurt': 'mean'})
-    df_grouped = df_grouped.drop([98, 99, ]).rename(columns={'p1': 'count'})
+    df_grouped = _get_weighted_means(df, ['p45a', 'p_year'], ['hurt'])
+    df_grouped = df_grouped.drop([98, 99, ])
 
     # confirm theory that mostly represented cars participate in most accidents
     most_accidents = df_grouped['count'].nlargest(3).reset_index()
@@ -119,9 +147,12 @@ def find_worst_scenario(df: pd.DataFrame):
 
 def print_stats(df: pd.DataFrame):
     """Print stats about dataset"""
-    print(f'Mean rate of death in selected accidents: {df["p13a"].mean() * 100:.2f}%')
-    print(f'Mean rate of hard injury in selected accidents: {df["p13b"].mean() * 100:.2f}%')
-    print(f'Mean rate of low injury in selected accidents: {df["p13c"].mean() * 100:.2f}%\n')
+    # rows of stratified sample are weighted by scale
+    weights = DataDownloader.get_row_weights(df)
+    means = df[['p13a', 'p13b', 'p13c']].multiply(weights, axis=0).sum() / weights.sum()
+    print(f'Mean rate of death in selected accidents: {means["p13a"] * 100:.2f}%')
+    print(f'Mean rate of hard injury in selected accidents: {means["p13b"] * 100:.2f}%')
+    print(f'Mean rate of low injury in selected accidents: {means["p13c"] * 100:.2f}%\n')
 
 
 if __name__ == "__main__":
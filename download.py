@@ -3,18 +3,134 @@ import pickle
 import re
 
 from gzip import open as open_gzip
-from requests import get as get_request
+from hashlib import blake2b
+from zlib import crc32
 from os import path, makedirs, listdir, remove as remove_file
-from bs4 import BeautifulSoup
+from time import sleep
 from zipfile import ZipFile
 from csv import reader
-from io import TextIOWrapper
+from io import TextIOWrapper, BytesIO
+from instrument import DISABLED as INSTRUMENTATION_DISABLED
+from index import PrimaryKeyIndex
+from lease import claim_lease, touch_lease, release_lease, replace_atomically
+from manifest import create_manifest, load_manifest, save_manifest, partition_may_match, get_file_hash
 
 
 class DataDownloader:
     """Class for fetching and parsing data about car accidents in Czech republic"""
 
-    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/", folder="data", cache_filename="data_{}.pkl.gz"):
+    # csv headers, range holds list of inclusive intervals of valid values used for validity mask
+    csv_headers = [{"label": "p1", "d_type": "i8", "range": [(0, 999999999999)]},
+                   {"label": "p36", "d_type": "i1", "range": [(0, 8)]},
+                   # IDENTIFIKAČNÍ ČÍSLO (0-999 999 999 999), DRUH POZEMNÍ KOMUNIKACE (0-8)
+                   {"label": "p37", "d_type": "i4", "range": [(0, 999999)]},
+                   {"label": "p2a", "d_type": "datetime64[D]"},
+                   # ČÍSLO POZEMNÍ KOMUNIKACE (0-999 999), ČASOVÉ ÚDAJE O DOPRAVNÍ NEHODĚ (YYYY-MM-DD)
+                   {"label": "weekday(p2a)", "d_type": "i1", "range": [(0, 7)]}, {"label": "p2b", "d_type": "i2"},
+                   # DEN TÝDNE (0-7),
+                   # ČASOVÉ ÚDAJE O DOPRAVNÍ NEHODĚ (HHMM, 25xx - unspecified hour, xx60, unspecified minute)
+                   {"label": "p6", "d_type": "i1", "range": [(0, 9)]},
+                   {"label": "p7", "d_type": "i1", "range": [(0, 4)]},
+                   # DRUH NEHODY (0-9), DRUH SRÁŽKY JEDOUCÍCH VOZIDEL (0-4)
+                   {"label": "p8", "d_type": "i1", "range": [(0, 9)]},
+                   {"label": "p9", "d_type": "i1", "range": [(1, 2)]},
+                   # DRUH PEVNÉ PŘEKÁŽKY (0-9), CHARAKTER NEHODY (1-2)
+                   {"label": "p10", "d_type": "i1", "range": [(0, 7)]},
+                   {"label": "p11", "d_type": "i1", "range": [(0, 9)]},
+                   # ZAVINĚNÍ NEHODY (0-7), ALKOHOL U VINÍKA NEHODY PŘÍTOMEN (0-9)
+                   {"label": "p12", "d_type": "i2",
+                    "range": [(100, 100), (201, 209), (301, 311), (401, 414), (501, 516), (601, 615)]},
+                   {"label": "p13a", "d_type": "i1", "range": [(0, 127)]},
+                   # HLAVNÍ PŘÍČINY NEHODY (100-615), USMRCENO OSOB (0-127)
+                   {"label": "p13b", "d_type": "i1", "range": [(0, 127)]},
+                   {"label": "p13c", "d_type": "i1", "range": [(0, 127)]},
+                   # TĚŽCE ZRANĚNO OSOB (0-127), LEHCE ZRANĚNO OSOB(0-127)
+                   {"label": "p14", "d_type": "i4", "range": [(0, 2 ** 31 - 1)]},
+                   {"label": "p15", "d_type": "i1", "range": [(1, 6)]},
+                   # CELKOVÁ HMOTNÁ ŠKODA (0-2^31), DRUH POVRCHU VOZOVKY (1-6)
+                   {"label": "p16", "d_type": "i1", "range": [(0, 9)]},
+                   {"label": "p17", "d_type": "i1", "range": [(1, 12)]},
+                   # STAV POVRCHU VOZOVKY V DOBĚ NEHODY (0-9), STAV KOMUNIKACE (1-12)
+                   {"label": "p18", "d_type": "i1", "range": [(0, 7)]},
+                   {"label": "p19", "d_type": "i1", "range": [(1, 7)]},
+                   # POVĚTRNOSTNÍ PODMÍNKY V DOBĚ NEHODY (0-7), VIDITELNOST (1-7)
+                   {"label": "p20", "d_type": "i1", "range": [(0, 6)]},
+                   {"label": "p21", "d_type": "i1", "range": [(0, 6)]},
+                   # ROZHLEDOVÉ POMĚRY (0-6), DĚLENÍ KOMUNIKACE (0-6)
+                   {"label": "p22", "d_type": "i1", "range": [(0, 9)]},
+                   {"label": "p23", "d_type": "i1", "range": [(0, 3)]},
+                   # SITUOVÁNÍ NEHODY NA KOMUNIKACI (0-9), ŘÍZENÍ PROVOZU V DOBĚ NEHODY (0-3)
+                   {"label": "p24", "d_type": "i1", "range": [(0, 5)]},
+                   {"label": "p27", "d_type": "i1", "range": [(0, 10)]},
+                   # MÍSTNÍ ÚPRAVA PŘEDNOSTI V JÍZDĚ (0-5), SPECIFICKÁ MÍSTA A OBJEKTY V MÍSTĚ NEHODY (0-10)
+                   {"label": "p28", "d_type": "i1", "range": [(1, 7)]},
+                   {"label": "p34", "d_type": "i1", "range": [(0, 127)]},
+                   # SMĚROVÉ POMĚRY (1-7), POČET ZÚČASTNĚNÝCH VOZIDEL (0-127)
+                   {"label": "p35", "d_type": "i1", "range": [(0, 29)]},
+                   {"label": "p39", "d_type": "i1", "range": [(1, 3), (6, 7), (9, 9)]},
+                   # MÍSTO DOPRAVNÍ NEHODY (0-29), DRUH KŘIŽUJÍCÍ KOMUNIKACE (1,2,3,6,7,9)
+                   {"label": "p44", "d_type": "i1", "range": [(0, 18)]},
+                   {"label": "p45a", "d_type": "i1", "range": [(0, 99)]},
+                   # DRUH VOZIDLA (0-18), VÝROBNÍ ZNAČKA MOTOROVÉHO VOZIDLA(0-99)
+                   {"label": "p47", "d_type": "i1", "range": [(0, 99)]},
+                   {"label": "p48a", "d_type": "i1", "range": [(0, 18)]},
+                   # ROK VÝROBY VOZIDLA (XX, 0-99), CHARAKTERISTIKA VOZIDLA (0-18)
+                   {"label": "p49", "d_type": "i1", "range": [(0, 1)]},
+                   {"label": "p50a", "d_type": "i1", "range": [(0, 4)]},
+                   # SMYK (0-1), VOZIDLO PO NEHODĚ (0-4)
+                   {"label": "p50b", "d_type": "i1", "range": [(0, 4)]},
+                   {"label": "p51", "d_type": "i1", "range": [(1, 3)]},
+                   # ÚNIK PROVOZNÍCH, PŘEPRAVOVANÝCH HMOT (0-4), ZPŮSOB VYPROŠTĚNÍ OSOB Z VOZIDLA (1-3)
+                   {"label": "p52", "d_type": "i1", "range": [(1, 99)]},
+                   {"label": "p53", "d_type": "i4", "range": [(0, 2 ** 31 - 1)]},
+                   # SMĚR JÍZDY NEBO POSTAVENÍ VOZIDLA (1 - 99), ŠKODA NA VOZIDLE v 100KČ (0 - 2^31)
+                   {"label": "p55a", "d_type": "i1", "range": [(0, 9)]},
+                   {"label": "p57", "d_type": "i1", "range": [(0, 9)]},
+                   # KATEGORIE ŘIDIČE (0-9), STAV ŘIDIČE (0-9)
+                   {"label": "p58", "d_type": "i1", "range": [(0, 5)]},
+                   # VNĚJŠÍ OVLIVNĚNÍ ŘIDIČE (0-5)
+                   {"label": "a", "d_type": "f8"}, {"label": "b", "d_type": "f8"},
+                   # LOKACE
+                   {"label": "d", "d_type": "f8"}, {"label": "e", "d_type": "f8"},
+                   # LOKACE
+                   {"label": "f", "d_type": "f8"}, {"label": "g", "d_type": "f8"},
+                   # LOKACE
+                   {"label": "h", "d_type": "<U64"}, {"label": "i", "d_type": "<U32"},
+                   # LOKACE txt
+                   {"label": "j", "d_type": "i1"}, {"label": "k", "d_type": "<U32"},
+                   #  NOT DEFINED IN DATASETS, TYP SILNICE txt
+                   {"label": "l", "d_type": "<U6"}, {"label": "n", "d_type": "i8"},
+                   # ČÍSLO SILNICE, XXX
+                   {"label": "o", "d_type": "f8"}, {"label": "p", "d_type": "<U32"},
+                   # XXX, SMĚR JÍZDY
+                   {"label": "q", "d_type": "<U32"}, {"label": "r", "d_type": "i8"},
+                   # PRUH, XXX
+                   {"label": "s", "d_type": "i8"}, {"label": "t", "d_type": "<U32"},
+                   # XXX, UNKNOWN IDETINTIFIER
+                   {"label": "p5a", "d_type": "i1", "range": [(1, 2)]},
+                   # LOKALITA NEHODY (1-2)
+                   {"label": "region", "d_type": "<U3"},
+                   # REGION ('XXX')
+                   ]
+    # columns computed from parsed csv columns and stored together with them in cache
+    derived_headers = [{"label": "valid", "d_type": "u8"},
+                       # BIT MASK OF VALID VALUES, BIT ORDER IS GIVEN BY validity_bits
+                       {"label": "year", "d_type": "i2"}, {"label": "month", "d_type": "i4"},
+                       # ROK (YYYY), INDEX MĚSÍCE OD 1970-01 (0-)
+                       {"label": "day_of_year", "d_type": "i2"}, {"label": "hour", "d_type": "i1"},
+                       # DEN V ROCE (1-366), HODINA (0-23, -1 unspecified)
+                       {"label": "minute", "d_type": "i1"}, {"label": "time_unknown", "d_type": "?"},
+                       # MINUTA (0-59, -1 unspecified), HODINA NEBO MINUTA NENÍ UVEDENA
+                       ]
+    column_headers = csv_headers + derived_headers
+    # bit of validity mask for every column with range of valid values
+    validity_bits = {item['label']: bit for bit, item in enumerate([item for item in csv_headers if 'range' in item])}
+    # hash of ranges of valid values, it is stored in cache file and valid column is computed again if it differs
+    validity_schema = blake2b(repr([(item['label'], item['range']) for item in csv_headers
+                                    if 'range' in item]).encode(), digest_size=8).hexdigest()
+
+    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/", folder="data", cache_filename="data_{}.pkl.gz",
+                 instrumentation=None, sample_fractions=(), offline=False):
         """Init method checks if directory exists in other case, tra to make it"""
         # check for valid paths
         if re.match(r'[^-_.A-Za-z0-9/]', folder):
@@ -31,6 +147,10 @@ class DataDownloader:
         # check if cache_filename is correct
         if re.fullmatch(r'[^{}/]*{}[^{}/]*\.pkl\.gz', cache_filename):
             self.cache_filename = cache_filename
+            # index of accident ids is stored next to cache file
+            self.index_filename = cache_filename[:-len('.pkl.gz')] + '.p1.npz'
+            # manifest with statistics of region partitioned by years is stored next to cache file
+            self.manifest_filename = cache_filename[:-len('.pkl.gz')] + '.manifest.json'
         else:
             raise ValueError(
                 f'Provided cache file_name could not be formatted, or file type is not .pkl.gz: {cache_filename} ')
@@ -38,8 +158,27 @@ class DataDownloader:
         # add attribute for datasets that needs to be parsed
         self.parsed_data = {}
         self.parsed_regions = []
+        self.parsed_indices = {}
+        self.parsed_manifests = {}
+        self.parsed_samples = {}
+        self.dataset_hashes = {}
+        # parsed regions are stored one after another in single buffer per column, regions hold views to them
+        self.parsed_buffers = None
+        self.parsed_ranges = {}
         self.non_duplicate_datasets = None
 
+        # fractions of stratified samples which are rebuilt together with cache files
+        for fraction in sample_fractions:
+            if not 0 < fraction <= 1:
+                raise ValueError(f'Provided sample fraction is not in interval (0, 1>: {fraction}')
+        self.sample_fractions = list(sample_fractions)
+
+        # instrumentation of processing stages, disabled by default
+        self.instrumentation = instrumentation or INSTRUMENTATION_DISABLED
+
+        # in offline mode only local datasets and cache files are used, network libraries are never imported
+        self.offline = offline
+
         # add headers to look like browser
         self.url = url
         self.headers = {
@@ -74,76 +213,6 @@ class DataDownloader:
             "LBK": "18.csv",
             "KVK": "19.csv",
         }
-        self.csv_headers = [{"label": "p1", "d_type": "i8"}, {"label": "p36", "d_type": "i1"},
-                            # IDENTIFIKAČNÍ ČÍSLO (0-999 999 999 999), DRUH POZEMNÍ KOMUNIKACE (0-8)
-                            {"label": "p37", "d_type": "i4"}, {"label": "p2a", "d_type": "datetime64[D]"},
-                            # ČÍSLO POZEMNÍ KOMUNIKACE (0-999 999), ČASOVÉ ÚDAJE O DOPRAVNÍ NEHODĚ (YYYY-MM-DD)
-                            {"label": "weekday(p2a)", "d_type": "i1"}, {"label": "p2b", "d_type": "i2"},
-                            # DEN TÝDNE (0-7),
-                            # ČASOVÉ ÚDAJE O DOPRAVNÍ NEHODĚ (HHMM, 25xx - unspecified hour, xx60, unspecified minute)
-                            {"label": "p6", "d_type": "i1"}, {"label": "p7", "d_type": "i1"},
-                            # DRUH NEHODY (0-9), DRUH SRÁŽKY JEDOUCÍCH VOZIDEL (0-4)
-                            {"label": "p8", "d_type": "i1"}, {"label": "p9", "d_type": "i1"},
-                            # DRUH PEVNÉ PŘEKÁŽKY (0-9), CHARAKTER NEHODY (1-2)
-                            {"label": "p10", "d_type": "i1"}, {"label": "p11", "d_type": "i1"},
-                            # ZAVINĚNÍ NEHODY (0-7), ALKOHOL U VINÍKA NEHODY PŘÍTOMEN (0-9)
-                            {"label": "p12", "d_type": "i2"}, {"label": "p13a", "d_type": "i1"},
-                            # HLAVNÍ PŘÍČINY NEHODY (100-615), USMRCENO OSOB (0-127)
-                            {"label": "p13b", "d_type": "i1"}, {"label": "p13c", "d_type": "i1"},
-                            # TĚŽCE ZRANĚNO OSOB (0-127), LEHCE ZRANĚNO OSOB(0-127)
-                            {"label": "p14", "d_type": "i4"}, {"label": "p15", "d_type": "i1"},
-                            # CELKOVÁ HMOTNÁ ŠKODA (0-2^31), DRUH POVRCHU VOZOVKY (1-6)
-                            {"label": "p16", "d_type": "i1"}, {"label": "p17", "d_type": "i1"},
-                            # STAV POVRCHU VOZOVKY V DOBĚ NEHODY (0-9), STAV KOMUNIKACE (1-12)
-                            {"label": "p18", "d_type": "i1"}, {"label": "p19", "d_type": "i1"},
-                            # POVĚTRNOSTNÍ PODMÍNKY V DOBĚ NEHODY (0-7), VIDITELNOST (1-7)
-                            {"label": "p20", "d_type": "i1"}, {"label": "p21", "d_type": "i1"},
-                            # ROZHLEDOVÉ POMĚRY (0-6), DĚLENÍ KOMUNIKACE (0-6)
-                            {"label": "p22", "d_type": "i1"}, {"label": "p23", "d_type": "i1"},
-                            # SITUOVÁNÍ NEHODY NA KOMUNIKACI (0-9), ŘÍZENÍ PROVOZU V DOBĚ NEHODY (0-3)
-                            {"label": "p24", "d_type": "i1"}, {"label": "p27", "d_type": "i1"},
-                            # MÍSTNÍ ÚPRAVA PŘEDNOSTI V JÍZDĚ (0-5), SPECIFICKÁ MÍSTA A OBJEKTY V MÍSTĚ NEHODY (0-10)
-                            {"label": "p28", "d_type": "i1"}, {"label": "p34", "d_type": "i1"},
-                            # SMĚROVÉ POMĚRY (1-7), POČET ZÚČASTNĚNÝCH VOZIDEL (0-127)
-                            {"label": "p35", "d_type": "i1"}, {"label": "p39", "d_type": "i1"},
-                            # MÍSTO DOPRAVNÍ NEHODY (0-29), DRUH KŘIŽUJÍCÍ KOMUNIKACE (1,2,3,6,7,9)
-                            {"label": "p44", "d_type": "i1"}, {"label": "p45a", "d_type": "i1"},
-                            # DRUH VOZIDLA (0-18), VÝROBNÍ ZNAČKA MOTOROVÉHO VOZIDLA(0-99)
-                            {"label": "p47", "d_type": "i1"}, {"label": "p48a", "d_type": "i1"},
-                            # ROK VÝROBY VOZIDLA (XX, 0-99), CHARAKTERISTIKA VOZIDLA (0-18)
-                            {"label": "p49", "d_type": "i1"}, {"label": "p50a", "d_type": "i1"},
-                            # SMYK (0-1), VOZIDLO PO NEHODĚ (0-4)
-                            {"label": "p50b", "d_type": "i1"}, {"label": "p51", "d_type": "i1"},
-                            # ÚNIK PROVOZNÍCH, PŘEPRAVOVANÝCH HMOT (0-4), ZPŮSOB VYPROŠTĚNÍ OSOB Z VOZIDLA (1-3)
-                            {"label": "p52", "d_type": "i1"}, {"label": "p53", "d_type": "i4"},
-                            # SMĚR JÍZDY NEBO POSTAVENÍ VOZIDLA (1 - 99), ŠKODA NA VOZIDLE v 100KČ (0 - 2^31)
-                            {"label": "p55a", "d_type": "i1"}, {"label": "p57", "d_type": "i1"},
-                            # KATEGORIE ŘIDIČE (0-9), STAV ŘIDIČE (0-9)
-                            {"label": "p58", "d_type": "i1"},
-                            # VNĚJŠÍ OVLIVNĚNÍ ŘIDIČE (0-5)
-                            {"label": "a", "d_type": "f8"}, {"label": "b", "d_type": "f8"},
-                            # LOKACE
-                            {"label": "d", "d_type": "f8"}, {"label": "e", "d_type": "f8"},
-                            # LOKACE
-                            {"label": "f", "d_type": "f8"}, {"label": "g", "d_type": "f8"},
-                            # LOKACE
-                            {"label": "h", "d_type": "<U64"}, {"label": "i", "d_type": "<U32"},
-                            # LOKACE txt
-                            {"label": "j", "d_type": "i1"}, {"label": "k", "d_type": "<U32"},
-                            #  NOT DEFINED IN DATASETS, TYP SILNICE txt
-                            {"label": "l", "d_type": "<U6"}, {"label": "n", "d_type": "i8"},
-                            # ČÍSLO SILNICE, XXX
-                            {"label": "o", "d_type": "f8"}, {"label": "p", "d_type": "<U32"},
-                            # XXX, SMĚR JÍZDY
-                            {"label": "q", "d_type": "<U32"}, {"label": "r", "d_type": "i8"},
-                            # PRUH, XXX
-                            {"label": "s", "d_type": "i8"}, {"label": "t", "d_type": "<U32"},
-                            # XXX, UNKNOWN IDETINTIFIER
-                            {"label": "p5a", "d_type": "i1"},
-                            # LOKALITA NEHODY (1-2)
-                            {"label": "region", "d_type": "<U3"},
-                            # REGION ('XXX')
-                            ]
 
     @staticmethod
     def concat_np_data_list(prev_data, data_to_concat):
@@ -154,6 +223,82 @@ class DataDownloader:
             prev_data[index] = np.concatenate([prev_data[index], value])
         return prev_data
 
+    @staticmethod
+    def compute_validity(labels, values):
+        """Compute bit mask of valid values for every row, bit is set if value lies in range of its column"""
+        valid = np.zeros(shape=len(values[0]) if values else 0, dtype='u8')
+        for item in DataDownloader.csv_headers:
+            if 'range' not in item or item['label'] not in labels:
+                continue
+            data = values[labels.index(item['label'])]
+            mask = np.zeros(shape=len(data), dtype=bool)
+            for low, high in item['range']:
+                mask |= (data >= low) & (data <= high)
+            valid |= mask.astype('u8') << np.uint64(DataDownloader.validity_bits[item['label']])
+        return valid
+
+    @staticmethod
+    def compute_time_features(labels, values):
+        """Decode date p2a and time p2b to compact time columns from derived_headers"""
+        dates = values[labels.index('p2a')]
+        years = dates.astype('datetime64[Y]')
+        times = values[labels.index('p2b')].astype('i4')
+        hours = times // 100
+        minutes = times % 100
+        # 25xx means unspecified hour and xx60 unspecified minute, values which could not be parsed are -1
+        unknown_hours = (times < 0) | (hours > 23)
+        unknown_minutes = (times < 0) | (minutes > 59)
+        return {
+            'year': (years.astype('i4') + 1970).astype('i2'),
+            'month': dates.astype('datetime64[M]').astype('i4'),
+            'day_of_year': ((dates - years.astype('datetime64[D]')).astype('i4') + 1).astype('i2'),
+            'hour': np.where(unknown_hours, -1, hours).astype('i1'),
+            'minute': np.where(unknown_minutes, -1, minutes).astype('i1'),
+            'time_unknown': unknown_hours | unknown_minutes,
+        }
+
+    @staticmethod
+    def get_valid_mask(valid, columns):
+        """Get mask of rows with valid values in all provided columns from validity bit mask"""
+        bits = np.uint64(sum(1 << DataDownloader.validity_bits[column] for column in columns))
+        return (np.asarray(valid, dtype='u8') & bits) == bits
+
+    @staticmethod
+    def get_frame_valid_mask(data, columns):
+        """Get mask of rows of mapping of columns with valid values, validity bit mask from cache is used if present"""
+        if 'valid' in data:
+            valid = np.asarray(data['valid'])
+        else:
+            valid = DataDownloader.compute_validity(columns, [np.asarray(data[column]) for column in columns])
+        return DataDownloader.get_valid_mask(valid, columns)
+
+    @staticmethod
+    def get_row_weights(data):
+        """Get weight of every row of mapping of columns, rows of stratified sample have their scale-up factor"""
+        if 'scale' in data:
+            return np.asarray(data['scale'], dtype='f8')
+        return np.ones(shape=len(data[next(iter(data))]) if len(data) else 0, dtype='i8')
+
+    @staticmethod
+    def get_filter_mask(labels, values, filters, rows=None):
+        """Create mask from filters, value is compared for equality, list for membership and dict for range"""
+        # if positions of rows are provided, mask is created only for them
+        mask = np.ones(shape=len(rows) if rows is not None else len(values[0]) if values else 0, dtype=bool)
+        for column, value in (filters or {}).items():
+            if column not in labels:
+                raise ValueError(f'Provided column {column} does not exist')
+            data = values[labels.index(column)] if rows is None else values[labels.index(column)][rows]
+            if isinstance(value, dict):
+                if 'min' in value:
+                    mask &= data >= DataDownloader.__get_filter_value(value['min'], data)
+                if 'max' in value:
+                    mask &= data <= DataDownloader.__get_filter_value(value['max'], data)
+            elif isinstance(value, list):
+                mask &= np.isin(data, DataDownloader.__get_filter_value(value, data))
+            else:
+                mask &= data == DataDownloader.__get_filter_value(value, data)
+        return mask
+
     @staticmethod
     def get_best_match(year, datasets):
         """Find the best dataset to avoid duplicity"""
@@ -185,14 +330,26 @@ class DataDownloader:
             file_name = re_name.search(file_path).group(0)
             self.__download_file(file_path, file_name)
 
-    def get_list(self, regions=None):
-        """Get list of data corresponding to selected regions"""
+    def get_list(self, regions=None, date_range=None, filters=None):
+        """Get list of data corresponding to selected regions, optionally only rows matching date range and filters"""
         existing_regions = self.region_files
         if regions is None:
             regions = list(existing_regions.keys())
         if type(regions) != list:
             raise ValueError('Provided regions are not list')
         self.__actualize_datasets()
+        filters = DataDownloader.__merge_date_range(date_range, filters)
+        matching_years = {}
+        # regions loaded to create missing manifests are kept, so they are not read again
+        loaded_regions = {}
+        if filters:
+            for region in regions:
+                if region not in existing_regions:
+                    raise ValueError(f'Provided region {region} does not exist')
+                matching_years[region] = self.__get_matching_years(region, filters, loaded_regions)
+            # regions without any partition that could match are not loaded at all
+            regions = [region for region in regions if matching_years[region]]
+            loaded_regions = {region: data for region, data in loaded_regions.items() if region in regions}
         non_parsed_regions = [region for region in regions if region not in self.parsed_regions]
         cached_regions, cached_region_files = self.__get_existing_cache_files()
 
@@ -200,37 +357,207 @@ class DataDownloader:
             if region not in existing_regions:
                 raise ValueError(f'Provided region {region} does not exist')
             # region is loaded in self.parsed_data
-            if region in self.parsed_regions:
+            if region in self.parsed_regions or region in loaded_regions:
                 continue
-            if region in cached_regions:
-                # we read content of cache file and store it to the self.parsed_data
-                with open_gzip(path.join(self.folder, cached_region_files[cached_regions.index(region)]),
-                               'rb') as cache_file:
-                    data = pickle.load(cache_file)
-                    self.__region_processed(region, data)
-            else:
-                # we need to parse region
-                self.__process_region(region)
+            # we read content of cache file or parse region
+            loaded_regions[region] = self.__load_region(region, cached_regions, cached_region_files)
+        # all loaded regions are stored to the self.parsed_data at once, so buffers grow only once
+        if loaded_regions:
+            self.__regions_processed(loaded_regions)
         # data are saved in dictionary so we need to get one list
-        return self.__get_list_from_parsed_data(regions)
+        with self.instrumentation.span('concat'):
+            labels, values = self.__get_list_from_parsed_data(regions)
+        if filters:
+            with self.instrumentation.span('filter'):
+                # filters are evaluated only on rows of year partitions which could match
+                rows = self.__get_partition_rows(regions, labels, values, matching_years)
+                rows = rows[DataDownloader.get_filter_mask(labels, values, filters, rows)]
+                values = [value[rows] for value in values]
+        # gathered and filtered copies are read only as well as views, so callers see same behaviour in all cases
+        return labels, [DataDownloader.__read_only_view(value) for value in values]
+
+    def get_manifest(self, region):
+        """Get manifest of region with row counts, sources and column statistics of every year partition"""
+        if region not in self.region_files:
+            raise ValueError(f'Provided region {region} does not exist')
+        if region not in self.parsed_manifests:
+            self.parsed_manifests[region] = self.__load_manifest(region)
+        return self.parsed_manifests[region]
+
+    def get_index(self, regions=None):
+        """Get index of accident ids p1 to row positions in output of get_list called with same regions"""
+        existing_regions = self.region_files
+        if regions is None:
+            regions = list(existing_regions.keys())
+        if type(regions) != list:
+            raise ValueError('Provided regions are not list')
+        indices = []
+        for region in regions:
+            if region not in existing_regions:
+                raise ValueError(f'Provided region {region} does not exist')
+            if region not in self.parsed_indices:
+                self.parsed_indices[region] = self.__load_index(region)
+            indices.append(self.parsed_indices[region])
+        return PrimaryKeyIndex.merge(indices)
 
-    def parse_region_data(self, region, should_actualize_datasets=True):
+    def export_dataset(self, folder=None, regions=None, row_group_size=16384):
+        """Write selected regions as parquet dataset partitioned by region and year, requires pyarrow"""
+        import dataset
+
+        folder = folder or path.join(self.folder, 'dataset')
+        # partitions of exported regions are written again from scratch
+        dataset.remove_partitions(folder, regions if regions is not None else list(self.region_files.keys()))
+        file_paths = []
+        for region, year, columns in self.iter_chunks(regions):
+            with self.instrumentation.span('export'):
+                file_paths.append(dataset.write_partition(folder, region, year, columns, row_group_size))
+        return file_paths
+
+    def read_dataset(self, folder=None, columns=None, regions=None, date_range=None, filters=None):
+        """Read parquet dataset written by export_dataset, only partitions and row groups matching filters are read"""
+        import dataset
+
+        folder = folder or path.join(self.folder, 'dataset')
+        with self.instrumentation.span('read_dataset'):
+            return dataset.read_dataset(folder, self.column_headers, columns, regions, date_range, filters)
+
+    def iter_chunks(self, regions=None, columns=None, date_range=None, filters=None):
+        """Iterate over data of selected regions by years as tuple(region, year, dict[str, np.ndarray])"""
+        filters = DataDownloader.__merge_date_range(date_range, filters)
+        existing_regions = self.region_files
+        if regions is None:
+            regions = list(existing_regions.keys())
+        if type(regions) != list:
+            raise ValueError('Provided regions are not list')
+        labels = [item['label'] for item in self.column_headers]
+        columns = columns or labels
+        for column in columns:
+            if column not in labels:
+                raise ValueError(f'Provided column {column} does not exist')
+        self.__actualize_datasets()
+        cached_regions, cached_region_files = self.__get_existing_cache_files()
+
+        for region in regions:
+            if region not in existing_regions:
+                raise ValueError(f'Provided region {region} does not exist')
+            # years which could not match filters are skipped by statistics in manifest
+            matching_years = None
+            loaded_regions = {}
+            if filters:
+                matching_years = self.__get_matching_years(region, filters, loaded_regions)
+                if not matching_years:
+                    continue
+            if region in self.parsed_regions:
+                _, values = self.parsed_data[region]
+            elif region in loaded_regions:
+                # region was loaded to create missing manifest
+                _, values = loaded_regions.pop(region)
+            else:
+                # region is not kept in self.parsed_data, so only single region is held in memory at time
+                _, values = self.__load_region(region, cached_regions, cached_region_files)
+            # split region by years of accidents
+            years = values[labels.index('year')]
+            # filters are evaluated once for whole region, not again for every year
+            region_mask = DataDownloader.get_filter_mask(labels, values, filters) if filters else None
+            for year in np.unique(years):
+                if matching_years is not None and year not in matching_years:
+                    continue
+                mask = years == year
+                if region_mask is not None:
+                    mask &= region_mask
+                yield region, int(year), {column: values[labels.index(column)][mask] for column in columns}
+            del values
+
+    def get_sample(self, regions=None, fraction=0.1):
+        """Get stratified sample of selected regions by years, column scale holds scale-up factor of each row"""
+        existing_regions = self.region_files
+        if regions is None:
+            regions = list(existing_regions.keys())
+        if type(regions) != list:
+            raise ValueError('Provided regions are not list')
+        if not 0 < fraction <= 1:
+            raise ValueError(f'Provided sample fraction is not in interval (0, 1>: {fraction}')
+        self.__actualize_datasets()
+
+        labels = None
+        values = []
+        scales = []
+        for region in regions:
+            if region not in existing_regions:
+                raise ValueError(f'Provided region {region} does not exist')
+            samples = self.parsed_samples.setdefault(fraction, {})
+            if region not in samples:
+                samples[region] = self.__load_sample(region, fraction)
+            sample = samples[region]
+            labels = sample['labels']
+            for _, stratum in sorted(sample['strata'].items()):
+                sample_rows = len(stratum['values'][0])
+                values.append(stratum['values'])
+                scales.append(np.full(shape=sample_rows, fill_value=stratum['rows'] / max(sample_rows, 1)))
+        if labels is None:
+            return ([item['label'] for item in self.column_headers] + ['scale'],
+                    [np.ndarray(shape=(0,), dtype=item['d_type']) for item in self.column_headers] +
+                    [np.ndarray(shape=(0,), dtype='f8')])
+        values = [np.concatenate([stratum[index] for stratum in values]) for index in range(len(labels))]
+        return labels + ['scale'], values + [np.concatenate(scales)]
+
+    def clear_parsed_data(self):
+        """Drop all parsed data held in memory"""
+        self.parsed_data = {}
+        self.parsed_regions = []
+        self.parsed_indices = {}
+        self.parsed_manifests = {}
+        self.parsed_samples = {}
+        self.parsed_buffers = None
+        self.parsed_ranges = {}
+
+    def parse_region_data(self, region, should_actualize_datasets=True, sources=None):
         """Parse data for current region to tuple(list[str], list[np.ndarray])"""
+        # if sources list is provided, tuple(archive, hash, rows) of every parsed dataset is appended to it
         if should_actualize_datasets:
             self.__download_missing_files()
         datasets = self.non_duplicate_datasets or self.__get_non_duplicate_datasets()
         parsed_data = [np.ndarray(shape=(0,), dtype=item['d_type']) for item in self.csv_headers]
         for dataset in datasets:
-            with ZipFile(path.join(self.folder, dataset)) as archive:
-                try:
-                    with archive.open(self.region_files[region], 'r') as file:
-                        parsed_data_to_merge = self.__parse_csv_file(file)
-                        parsed_data_to_merge[-1][:] = region
-                        parsed_data = DataDownloader.concat_np_data_list(parsed_data, parsed_data_to_merge)
-                except KeyError:
-                    raise KeyError(f'Provided region key: {region}, does not exist.')
+            parsed_data_to_merge = self.__parse_region_dataset(region, dataset)
+            with self.instrumentation.span('concat'):
+                parsed_data = DataDownloader.concat_np_data_list(parsed_data, parsed_data_to_merge)
+            if sources is not None:
+                sources.append((dataset, self.__get_dataset_hash(dataset), len(parsed_data_to_merge[0])))
         return [item['label'] for item in self.csv_headers], parsed_data
 
+    def build_cache(self, regions=None, lease_timeout=600, poll_interval=1.0):
+        """Build cache files cooperatively with other processes or hosts sharing same folder"""
+        # work is split to units region x dataset year, which are claimed by lease files in folder/build,
+        # finished units are merged to cache file of region by single worker in same order as serial build
+        existing_regions = self.region_files
+        if regions is None:
+            regions = list(existing_regions.keys())
+        if type(regions) != list:
+            raise ValueError('Provided regions are not list')
+        for region in regions:
+            if region not in existing_regions:
+                raise ValueError(f'Provided region {region} does not exist')
+        self.__actualize_datasets()
+        datasets = self.non_duplicate_datasets or self.__get_non_duplicate_datasets()
+        build_folder = path.join(self.folder, 'build')
+        makedirs(build_folder, exist_ok=True)
+
+        while True:
+            remaining_regions = [region for region in regions
+                                 if not path.exists(path.join(self.folder, self.cache_filename.format(region)))]
+            if not remaining_regions:
+                break
+            for region in remaining_regions:
+                for dataset in datasets:
+                    self.__build_unit(build_folder, region, dataset, lease_timeout)
+                if all(path.exists(self.__get_unit_path(build_folder, region, dataset)) for dataset in datasets):
+                    self.__merge_units(build_folder, region, datasets, lease_timeout)
+            # units claimed by other workers are not finished yet
+            if any(not path.exists(path.join(self.folder, self.cache_filename.format(region)))
+                   for region in remaining_regions):
+                sleep(poll_interval)
+
     """Private methods"""
 
     def __actualize_datasets(self):
@@ -240,30 +567,43 @@ class DataDownloader:
         if datasets_downloaded > 0:
             cache_regex = re.compile(self.cache_filename.format(r'(\w{3})'))
             # remove existing cache files
+            index_regex = re.compile(self.index_filename.format(r'(\w{3})'))
+            manifest_regex = re.compile(self.manifest_filename.format(r'(\w{3})'))
             files_in_directory = listdir(self.folder)
             for file in files_in_directory:
-                match = cache_regex.match(file)
-                if match:
+                if cache_regex.match(file) or index_regex.match(file) or manifest_regex.match(file):
                     remove_file(f'{self.folder}/{file}')
             # clear attributes
-            self.parsed_data = {}
-            self.parsed_regions = []
+            self.clear_parsed_data()
             self.non_duplicate_datasets = None
+            self.dataset_hashes = {}
 
     def __download_file(self, file_path, file_name):
         """ Download data in stream mode for faster processing"""
-        response = get_request(f'{self.url}{file_path}', headers=self.headers, stream=True)
-        # we check for status code before setting data
-        if response.status_code != 200:
-            raise ConnectionError(f'Could not fetch {self.url}{file_path}')
-        else:
-            # write to output file in chunks for faster
-            with open(f'{self.folder}/{file_name}', 'wb+') as file:
-                for chunk in response.iter_content(chunk_size=128):
-                    file.write(chunk)
+        # network libraries are imported lazily, cache only runs do not need them
+        from requests import get as get_request
+
+        with self.instrumentation.span('download'):
+            response = get_request(f'{self.url}{file_path}', headers=self.headers, stream=True)
+            # we check for status code before setting data
+            if response.status_code != 200:
+                raise ConnectionError(f'Could not fetch {self.url}{file_path}')
+            else:
+                # write to output file in chunks for faster, other processes never see partially downloaded file
+                replace_atomically(f'{self.folder}/{file_name}',
+                                   lambda file_path: self.__write_response(response, file_path))
+
+    def __write_response(self, response, file_path):
+        """Write content of streamed response to file"""
+        with open(file_path, 'wb+') as file:
+            for chunk in response.iter_content(chunk_size=128):
+                file.write(chunk)
+                self.instrumentation.count('bytes_downloaded', len(chunk))
 
     def __download_missing_files(self):
         """Detect any missing file in cwd"""
+        if self.offline:
+            return 0
         # regex to match only zip files
         re_name = re.compile(r'[^/]+\.zip')
         # get all available dataset paths in table on specified url and theirs names
@@ -298,6 +638,14 @@ class DataDownloader:
 
     def __get_dataset_names_from_url(self):
         """Get all dataset paths on specified url"""
+        with self.instrumentation.span('listing'):
+            return self.__list_dataset_names_from_url()
+
+    def __list_dataset_names_from_url(self):
+        """Fetch html table on specified url and select best matching dataset paths"""
+        from requests import get as get_request
+        from bs4 import BeautifulSoup
+
         response = get_request(self.url, headers=self.headers)
         if response.status_code != 200:
             raise ConnectionError(f'Could not fetch url "{self.url}"')
@@ -314,19 +662,26 @@ class DataDownloader:
         return [DataDownloader.get_best_match(year, dataset_paths) for year in years]
 
     def __get_list_from_parsed_data(self, regions):
-        """Merge dictionary values to one output array"""
+        """Get views to parsed buffers if regions are stored contiguously, in other case gather them to new arrays"""
         if len(regions) > 0:
             labels, _ = self.parsed_data[regions[0]]
-            values = None
-            for region in regions:
-                values = DataDownloader.concat_np_data_list(values, self.parsed_data[region][1])
+            ranges = [self.parsed_ranges[region] for region in regions]
+            if all(previous[1] == current[0] for previous, current in zip(ranges, ranges[1:])):
+                values = [DataDownloader.__read_only_view(buffer[ranges[0][0]:ranges[-1][1]])
+                          for buffer in self.parsed_buffers]
+            else:
+                values = [np.concatenate([buffer[start:stop] for start, stop in ranges])
+                          for buffer in self.parsed_buffers]
             return labels, values
-        return [], []
+        # labels are returned even if no region matched, so callers could build empty tables
+        return [item['label'] for item in self.column_headers], [np.ndarray(shape=(0,), dtype=item['d_type'])
+                                                                 for item in self.column_headers]
 
     def __get_non_duplicate_datasets(self):
         """Get non duplicate dataset names in cwd, to parse correct data"""
         datasets = self.__get_existing_datasets()
-        years = set([re.search(r'(\d{4}).zip', dataset).group(1) for dataset in datasets])
+        # years are sorted, so datasets are always parsed in same order
+        years = sorted(set([re.search(r'(\d{4}).zip', dataset).group(1) for dataset in datasets]))
 
         # set it to attribute to avoid redoing same piece of code
         self.non_duplicate_datasets = [DataDownloader.get_best_match(year, datasets) for year in years]
@@ -352,17 +707,348 @@ class DataDownloader:
                         parsed_data[index_val][index] = -1
         return parsed_data
 
-    def __process_region(self, region):
-        """Parse region, create cache file and copy data to attribute self.parsedData"""
-        data = self.parse_region_data(region, should_actualize_datasets=False)
-        with open_gzip(path.join(self.folder, self.cache_filename.format(region)), 'wb') as file:
+    def __load_region(self, region, cached_regions, cached_region_files):
+        """Read region from cache file, if it does not exist parse region and create it"""
+        if region not in cached_regions:
+            # we need to parse region
+            self.instrumentation.count('cache_misses')
+            return self.__process_region(region)
+        self.instrumentation.count('cache_hits')
+        cache_path = path.join(self.folder, cached_region_files[cached_regions.index(region)])
+        with self.instrumentation.span('cache_read'), open_gzip(cache_path, 'rb') as cache_file:
+            labels, values, *validity_schema = pickle.load(cache_file)
+        self.instrumentation.count('cache_bytes_in', path.getsize(cache_path))
+        # cache files created by older versions do not contain derived columns or schema of valid column
+        validity_schema = validity_schema[0] if validity_schema else None
+        data = self.__add_derived_columns((labels, values), validity_schema)
+        if validity_schema != self.validity_schema:
+            # cache is written again, so files stored next to it are older and they are created again too
+            with self.instrumentation.span('cache_write'):
+                replace_atomically(cache_path, lambda file_path: DataDownloader.__write_cache(data, file_path))
+        return data
+
+    def __add_derived_columns(self, data, validity_schema=None):
+        """Compute columns from derived_headers missing in data in one vectorized pass"""
+        labels, values = data
+        labels = list(labels)
+        values = list(values)
+        time_features = None
+        with self.instrumentation.span('derive'):
+            # valid column computed with other ranges of valid values is computed again
+            if 'valid' in labels and validity_schema != self.validity_schema:
+                values[labels.index('valid')] = DataDownloader.compute_validity(labels, values)
+            for item in self.derived_headers:
+                if item['label'] in labels:
+                    continue
+                if item['label'] == 'valid':
+                    values.append(DataDownloader.compute_validity(labels, values))
+                else:
+                    time_features = time_features or DataDownloader.compute_time_features(labels, values)
+                    values.append(time_features[item['label']])
+                labels.append(item['label'])
+        return labels, values
+
+    def __parse_region_dataset(self, region, dataset):
+        """Parse csv file of region from single dataset archive to list[np.ndarray]"""
+        with ZipFile(path.join(self.folder, dataset)) as archive:
+            try:
+                # decompress whole file at once, seeking in compressed stream would decompress it again
+                with self.instrumentation.span('decompress'), archive.open(self.region_files[region], 'r') as file:
+                    content = file.read()
+            except KeyError:
+                raise KeyError(f'Provided region key: {region}, does not exist.')
+        self.instrumentation.count('bytes_decompressed', len(content))
+        with self.instrumentation.span('parse'):
+            parsed_data = self.__parse_csv_file(BytesIO(content))
+        parsed_data[-1][:] = region
+        self.instrumentation.count('rows', len(parsed_data[0]))
+        return parsed_data
+
+    @staticmethod
+    def __get_unit_path(build_folder, region, dataset):
+        """Get path of parsed unit of cooperative build"""
+        return path.join(build_folder, f'{region}-{dataset}.pkl.gz')
+
+    def __build_unit(self, build_folder, region, dataset, lease_timeout):
+        """Parse dataset of region and save it to build folder, if unit is not done or claimed by other worker"""
+        unit_path = DataDownloader.__get_unit_path(build_folder, region, dataset)
+        lease_path = f'{unit_path}.lease'
+        if path.exists(unit_path) or not claim_lease(lease_path, lease_timeout):
+            return
+        try:
+            # unit could be finished or region merged while lease was claimed
+            if path.exists(unit_path) or path.exists(path.join(self.folder, self.cache_filename.format(region))):
+                return
+            parsed_data = self.__parse_region_dataset(region, dataset)
+            # lease was reclaimed by other worker, which builds same unit
+            if not touch_lease(lease_path):
+                return
+            unit = (dataset, self.__get_dataset_hash(dataset), parsed_data)
+            replace_atomically(unit_path, lambda file_path: DataDownloader.__write_pickle(unit, file_path))
+            self.instrumentation.count('units_built')
+        finally:
+            release_lease(lease_path)
+
+    def __merge_units(self, build_folder, region, datasets, lease_timeout):
+        """Merge all units of region to cache file in same order as serial build and remove them"""
+        lease_path = path.join(build_folder, f'{region}.merge.lease')
+        cache_path = path.join(self.folder, self.cache_filename.format(region))
+        if path.exists(cache_path) or not claim_lease(lease_path, lease_timeout):
+            return
+        try:
+            if path.exists(cache_path):
+                return
+            sources = []
+            parsed_data = [np.ndarray(shape=(0,), dtype=item['d_type']) for item in self.csv_headers]
+            for dataset in datasets:
+                try:
+                    with open_gzip(DataDownloader.__get_unit_path(build_folder, region, dataset), 'rb') as file:
+                        _, dataset_hash, parsed_data_to_merge = pickle.load(file)
+                except FileNotFoundError:
+                    # units are removed only after cache file was written by worker which reclaimed lease
+                    return
+                parsed_data = DataDownloader.concat_np_data_list(parsed_data, parsed_data_to_merge)
+                sources.append((dataset, dataset_hash, len(parsed_data_to_merge[0])))
+            # lease was reclaimed by other worker or region was already merged by it
+            if not touch_lease(lease_path) or path.exists(cache_path):
+                return
+            self.__store_region(region, ([item['label'] for item in self.csv_headers], parsed_data), sources)
+            for dataset in datasets:
+                try:
+                    remove_file(DataDownloader.__get_unit_path(build_folder, region, dataset))
+                except FileNotFoundError:
+                    pass
+        finally:
+            release_lease(lease_path)
+
+    @staticmethod
+    def __write_pickle(data, file_path):
+        """Write data to gzip compressed pickle"""
+        with open_gzip(file_path, 'wb') as file:
             pickle.dump(data, file)
-            self.__region_processed(region, data)
 
-    def __region_processed(self, region, data):
-        """Add data to attributes"""
-        self.parsed_data[region] = data
-        self.parsed_regions.append(region)
+    @staticmethod
+    def __write_cache(data, file_path):
+        """Write region data to cache file together with schema of valid column"""
+        labels, values = data
+        DataDownloader.__write_pickle((labels, values, DataDownloader.validity_schema), file_path)
+
+    def __process_region(self, region):
+        """Parse region and create cache file"""
+        sources = []
+        data = self.parse_region_data(region, should_actualize_datasets=False, sources=sources)
+        return self.__store_region(region, data, sources)
+
+    def __store_region(self, region, data, sources):
+        """Add derived columns to parsed region, create cache file and files stored next to it"""
+        data = self.__add_derived_columns(data)
+        cache_path = path.join(self.folder, self.cache_filename.format(region))
+        # cache is written atomically, so other processes never read partially written cache file
+        with self.instrumentation.span('cache_write'):
+            replace_atomically(cache_path, lambda file_path: DataDownloader.__write_cache(data, file_path))
+        self.instrumentation.count('cache_bytes_out', path.getsize(cache_path))
+        self.__create_index(region, data)
+        self.__create_manifest(region, data, sources)
+        # samples are rebuilt only for years which were changed
+        for fraction in self.sample_fractions:
+            self.__update_sample(region, data, fraction)
+        return data
+
+    def __create_manifest(self, region, data, sources=None):
+        """Create manifest of region and save it next to cache file"""
+        labels, values = data
+        with self.instrumentation.span('manifest'):
+            manifest = create_manifest(region, labels, values, sources)
+            replace_atomically(path.join(self.folder, self.manifest_filename.format(region)),
+                               lambda file_path: save_manifest(manifest, file_path))
+        self.parsed_manifests[region] = manifest
+        return manifest
+
+    def __load_manifest(self, region, loaded_regions=None):
+        """Read manifest of region from file, if it does not exist create it from region data"""
+        manifest_path = path.join(self.folder, self.manifest_filename.format(region))
+        return self.__load_cache_companion(region, manifest_path, load_manifest,
+                                           lambda data: self.__create_manifest(region, data), self.parsed_manifests,
+                                           loaded_regions)
+
+    def __load_cache_companion(self, region, file_path, load_file, create_file, parsed, loaded_regions=None):
+        """Read file stored next to cache file of region, if it is older than cache file create it from region data"""
+        cache_path = path.join(self.folder, self.cache_filename.format(region))
+        # file is valid only if it is not older than cache file
+        if path.exists(file_path) and path.exists(cache_path) and path.getmtime(file_path) >= path.getmtime(
+                cache_path):
+            return load_file(file_path)
+        if region in self.parsed_regions:
+            return create_file(self.parsed_data[region])
+        # if dict of loaded regions is provided, region data are taken from it and added to it
+        if loaded_regions is not None and region in loaded_regions:
+            data = loaded_regions[region]
+        else:
+            cached_regions, cached_region_files = self.__get_existing_cache_files()
+            data = self.__load_region(region, cached_regions, cached_region_files)
+            if loaded_regions is not None:
+                loaded_regions[region] = data
+        # file was already created if region had to be parsed
+        if region in parsed:
+            return parsed[region]
+        return create_file(data)
+
+    def __get_matching_years(self, region, filters, loaded_regions):
+        """Get years of region whose partitions could contain rows matching filters according to manifest"""
+        if region not in self.parsed_manifests:
+            self.parsed_manifests[region] = self.__load_manifest(region, loaded_regions)
+        partitions = self.parsed_manifests[region]['partitions']
+        matching_years = [int(year) for year, partition in partitions.items()
+                          if partition_may_match(partition, filters)]
+        self.instrumentation.count('partitions_skipped', len(partitions) - len(matching_years))
+        return matching_years
+
+    def __get_partition_rows(self, regions, labels, values, matching_years):
+        """Get positions of rows in output of get_list which belong to matching years of their region"""
+        years = values[labels.index('year')]
+        masks = []
+        start = 0
+        for region in regions:
+            region_start, region_stop = self.parsed_ranges[region]
+            stop = start + region_stop - region_start
+            if len(matching_years[region]) == len(self.get_manifest(region)['partitions']):
+                masks.append(np.ones(shape=stop - start, dtype=bool))
+            else:
+                masks.append(np.isin(years[start:stop], matching_years[region]))
+            start = stop
+        return np.flatnonzero(np.concatenate(masks)) if masks else np.ndarray(shape=(0,), dtype='i8')
+
+    def __get_dataset_hash(self, dataset):
+        """Get hash of dataset archive, it is computed only once for every archive"""
+        if dataset not in self.dataset_hashes:
+            self.dataset_hashes[dataset] = get_file_hash(path.join(self.folder, dataset))
+        return self.dataset_hashes[dataset]
+
+    @staticmethod
+    def __merge_date_range(date_range, filters):
+        """Add date range tuple(start, end) to filters as range of column p2a"""
+        if date_range is None:
+            return filters
+        start, end = date_range
+        filters = dict(filters or {})
+        date_filter = {}
+        if start is not None:
+            date_filter['min'] = str(np.datetime64(start, 'D'))
+        if end is not None:
+            date_filter['max'] = str(np.datetime64(end, 'D'))
+        filters['p2a'] = date_filter
+        return filters
+
+    @staticmethod
+    def __get_filter_value(value, data):
+        """Convert filter value to array comparable with column, only dates are converted to type of column"""
+        # other values keep their type, so numpy promotes them and values out of range of column match nothing
+        if data.dtype.kind == 'M':
+            return np.asarray(value, dtype=data.dtype)
+        return np.asarray(value)
+
+    def __get_sample_path(self, region, fraction):
+        """Get path of sample file of region, it is stored next to cache file"""
+        cache_name = self.cache_filename.format(region)[:-len('.pkl.gz')]
+        return path.join(self.folder, f'{cache_name}.sample-{fraction:g}.pkl.gz')
+
+    def __load_sample(self, region, fraction):
+        """Read sample of region from file, if it does not exist create it from region data"""
+        sample_path = self.__get_sample_path(region, fraction)
+        return self.__load_cache_companion(region, sample_path, self.__read_sample,
+                                           lambda data: self.__update_sample(region, data, fraction),
+                                           self.parsed_samples.setdefault(fraction, {}))
+
+    def __read_sample(self, sample_path):
+        """Read sample from gzip compressed pickle"""
+        with self.instrumentation.span('sample_read'), open_gzip(sample_path, 'rb') as file:
+            return pickle.load(file)
+
+    def __update_sample(self, region, data, fraction):
+        """Draw sample of every year of region, years with unchanged data reuse sample from existing file"""
+        labels, values = data
+        sample_path = self.__get_sample_path(region, fraction)
+        previous_strata = {}
+        if path.exists(sample_path):
+            previous = self.__read_sample(sample_path)
+            if previous['labels'] == list(labels):
+                previous_strata = previous['strata']
+
+        strata = {}
+        with self.instrumentation.span('sample'):
+            years = values[labels.index('year')]
+            for year in np.unique(years):
+                indices = np.flatnonzero(years == year)
+                # fingerprint covers whole rows, so corrected values with same ids draw new sample
+                fingerprint = blake2b()
+                for value in values:
+                    fingerprint.update(value[indices].tobytes())
+                fingerprint = fingerprint.hexdigest()
+                previous_stratum = previous_strata.get(int(year))
+                if previous_stratum is not None and previous_stratum['fingerprint'] == fingerprint:
+                    strata[int(year)] = previous_stratum
+                    continue
+                # seed depends on region and year, so same data always give same sample
+                rng = np.random.default_rng([crc32(region.encode()), int(year)])
+                size = max(1, int(round(len(indices) * fraction)))
+                chosen = np.sort(rng.choice(indices, size=size, replace=False))
+                strata[int(year)] = {'fingerprint': fingerprint, 'rows': len(indices),
+                                     'values': [value[chosen] for value in values]}
+                self.instrumentation.count('sample_strata_built')
+
+        sample = {'labels': list(labels), 'strata': strata}
+        # sample is written atomically, so other processes never read partially written file
+        with self.instrumentation.span('sample_write'):
+            replace_atomically(sample_path, lambda file_path: DataDownloader.__write_pickle(sample, file_path))
+        self.parsed_samples.setdefault(fraction, {})[region] = sample
+        return sample
+
+    def __create_index(self, region, data):
+        """Build index of accident ids for region and save it next to cache file"""
+        labels, values = data
+        with self.instrumentation.span('index'):
+            index = PrimaryKeyIndex.build(values[labels.index('p1')])
+            replace_atomically(path.join(self.folder, self.index_filename.format(region)), index.save)
+        self.instrumentation.count('duplicates', len(index.duplicate_positions()))
+        self.parsed_indices[region] = index
+        return index
+
+    def __load_index(self, region):
+        """Read index of region from file, if it does not exist create it from region data"""
+        index_path = path.join(self.folder, self.index_filename.format(region))
+        return self.__load_cache_companion(region, index_path, PrimaryKeyIndex.load,
+                                           lambda data: self.__create_index(region, data), self.parsed_indices)
+
+    def __regions_processed(self, regions_data):
+        """Append data of regions to parsed buffers and add views to them to attributes"""
+        labels = [item['label'] for item in self.column_headers]
+        start = max([stop for _, stop in self.parsed_ranges.values()], default=0)
+        size = start + sum(len(values[0]) for _, values in regions_data.values())
+
+        # reallocate buffers to exact new size, views held by callers keep old buffers alive until they are dropped
+        buffers = [np.empty(shape=size, dtype=item['d_type']) for item in self.column_headers]
+        if self.parsed_buffers is not None:
+            for buffer, parsed_buffer in zip(buffers, self.parsed_buffers):
+                buffer[:start] = parsed_buffer[:start]
+        for region, (_, values) in regions_data.items():
+            stop = start + len(values[0])
+            for buffer, value in zip(buffers, values):
+                buffer[start:stop] = value
+            self.parsed_ranges[region] = (start, stop)
+            self.parsed_regions.append(region)
+            start = stop
+        self.parsed_buffers = buffers
+
+        # views of all regions have to point to new buffers
+        for region, (start, stop) in self.parsed_ranges.items():
+            self.parsed_data[region] = (labels, [DataDownloader.__read_only_view(buffer[start:stop])
+                                                 for buffer in buffers])
+
+    @staticmethod
+    def __read_only_view(view):
+        """Mark view or array as read only, so callers could not modify parsed buffers"""
+        view.flags.writeable = False
+        return view
 
 
 if __name__ == '__main__':
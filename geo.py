@@ -1,12 +1,18 @@
 #!/usr/bin/python3.8
 # coding=utf-8
+from __future__ import annotations
+
 import pandas as pd
-import geopandas
-import matplotlib.pyplot as plt
-import contextily as ctx
-import sklearn.cluster
 import numpy as np
 
+from typing import TYPE_CHECKING
+from download import DataDownloader
+
+# heavy libraries are imported lazily in functions which need them
+if TYPE_CHECKING:
+    import geopandas
+    import matplotlib.pyplot as plt
+
 
 # muzeze pridat vlastni knihovny
 
@@ -20,6 +26,8 @@ def _save_show_fig(fig_location: str, show_figure: bool, fig: plt.Figure):
 
 def make_geo(df: pd.DataFrame) -> geopandas.GeoDataFrame:
     """ Konvertovani dataframe do geopandas.GeoDataFrame se spravnym kodovani"""
+    import geopandas
+
     df_cleaned = df.dropna(subset=['d', 'e'])
     # create GeoDataFrame in S-JTSK
     return geopandas.GeoDataFrame(df_cleaned,
@@ -30,6 +38,8 @@ def make_geo(df: pd.DataFrame) -> geopandas.GeoDataFrame:
 def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
              show_figure: bool = False):
     """ Vykresleni grafu s dvemi podgrafy podle lokality nehody """
+    import matplotlib.pyplot as plt
+    import contextily as ctx
 
     # filter by region and use CRS WGS84
     region = 'MSK'
@@ -66,6 +76,11 @@ def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
 def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
                  show_figure: bool = False):
     """ Vykresleni grafu s lokalitou vsech nehod v kraji shlukovanych do clusteru """
+    import geopandas
+    import matplotlib.pyplot as plt
+    import contextily as ctx
+    import sklearn.cluster
+
     # filter by region and use CRS WGS84
     region = 'MSK'
     gdf_region = gdf[gdf['region'] == region].to_crs("epsg:3857")
@@ -77,11 +92,12 @@ def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
     # copy dataset and group by clusters
     gdf_region_clusters = gdf_region.copy()
     gdf_region_clusters['cluster'] = clusters.labels_
+    gdf_region_clusters['count'] = DataDownloader.get_row_weights(gdf_region_clusters)
     gdf_center_coords = geopandas.GeoDataFrame(
         geometry=geopandas.points_from_xy(clusters.cluster_centers_[:, 0], clusters.cluster_centers_[:, 1]))
 
     # merge values to centred points
-    gdf_region_counts = gdf_region_clusters.groupby(['cluster'])['region'].count()
+    gdf_region_counts = gdf_region_clusters.groupby(['cluster'])['count'].sum()
     gdf_center_coords['count'] = gdf_region_counts
 
     # set figure
@@ -1,10 +1,10 @@
 import numpy as np
 
-from matplotlib.pyplot import subplots
 from argparse import ArgumentParser
 from re import match
 from os import path, makedirs
 from download import DataDownloader
+from instrument import Instrumentation
 
 
 def set_annotation_of_bars(ax, bars):
@@ -47,22 +47,50 @@ def plot_stat(data_source, fig_location=None, show_figure=False):
     """Generate histogram about count of accidents in regions by years"""
     labels, data = data_source
 
-    # get only interesting values from parsed data
-    dates = data[labels.index('p2a')]
+    # get only interesting values from parsed data, year is precomputed by downloader
+    years = data[labels.index('year')]
     regions = data[labels.index('region')]
 
-    # exclude years from datetime and get unique years
-    years = dates.astype('datetime64[Y]').astype("u2") + 1970
+    # get unique years
     years_unique = np.unique(years)
     years_unique = years_unique[np.where(years_unique > 2015)]
 
+    weights = DataDownloader.get_row_weights(dict(zip(labels, data)))
+    statistics = []
+    for year in years_unique:
+        year_regions, inverse = np.unique(regions[np.where(years == year)], return_inverse=True)
+        counts = np.bincount(inverse, weights=weights[np.where(years == year)]).round().astype('i8')
+        statistics.append((year, (year_regions, counts)))
+    plot_year_statistics(statistics, fig_location, show_figure)
+
+
+def plot_stat_chunks(chunks, fig_location=None, show_figure=False):
+    """Generate same histogram as plot_stat from iterator of chunks tuple(region, year, columns)"""
+    counts = {}
+    for region, year, columns in chunks:
+        if year > 2015:
+            year_counts = counts.setdefault(year, {})
+            year_counts[region] = year_counts.get(region, 0) + len(columns['region'])
+
+    # regions are sorted to get same order as np.unique in plot_stat
+    statistics = []
+    for year in sorted(counts):
+        regions = sorted(counts[year])
+        statistics.append((year, (np.array(regions), np.array([counts[year][region] for region in regions]))))
+    plot_year_statistics(statistics, fig_location, show_figure)
+
+
+def plot_year_statistics(statistics, fig_location=None, show_figure=False):
+    """Generate histogram from list of tuple(year, tuple(regions, counts))"""
+    # matplotlib is imported lazily to keep startup of cli fast
+    from matplotlib.pyplot import subplots
+
     # create figure with axes corresponding with unique years
-    fig, axes = subplots(nrows=len(years_unique), ncols=1, figsize=(12, 16), sharey=True)
+    fig, axes = subplots(nrows=len(statistics), ncols=1, figsize=(12, 16), sharey=True)
     fig.suptitle('Počet nehod v přislušných letech v českých krajích', fontsize=24, fontweight="bold")
 
     # generate axes and add padding for good looking output
-    for index, year in enumerate(years_unique):
-        year_statistic = np.unique(regions[np.where(years == year)], return_counts=True)
+    for index, (year, year_statistic) in enumerate(statistics):
         set_axis_content(axes, index, year, year_statistic)
     fig.tight_layout(pad=2)
 
@@ -87,12 +115,34 @@ if __name__ == '__main__':
                         help='path where to save graph outputs')
     parser.add_argument('--show_figure', action="store_true",
                         help='enables plotting')
+    parser.add_argument('--chunked', action="store_true",
+                        help='process regions one by one to lower memory usage')
+    parser.add_argument('--sample', type=float,
+                        help='use stratified sample with provided fraction of rows instead of all data')
+    parser.add_argument('--offline', action="store_true",
+                        help='use only local datasets and cache files, do not check url for new datasets')
+    parser.add_argument('--report', type=str,
+                        help='path where to save json report with timings and counters of processing stages')
     # In case that show_figure should accept values use next line of code and check value of equality with 'True'
     # parser.add_argument('--show_figure', nargs='?', const='True', type=str, default='False', help='enables plotting')
     args = parser.parse_args()
     regions_to_parse = ['HKK', 'JHC', 'JHM', 'KVK', 'LBK', 'MSK', 'OLK', 'PAK', 'PHA', 'PLK', 'STC', 'ULK', 'VYS',
                         'ZLK']
+    instrumentation = Instrumentation(enabled=args.report is not None)
     print(f'Parsing data for regions: {regions_to_parse}...')
-    parsed_data = DataDownloader().get_list(regions_to_parse)
-    print(f'Data were successfully parsed. Preparing plots...')
-    plot_stat(parsed_data, args.fig_location, args.show_figure)
+    downloader = DataDownloader(instrumentation=instrumentation, offline=args.offline)
+    if args.sample:
+        sample_data = downloader.get_sample(regions_to_parse, args.sample)
+        with instrumentation.span('plot'):
+            plot_stat(sample_data, args.fig_location, args.show_figure)
+    elif args.chunked:
+        with instrumentation.span('plot'):
+            plot_stat_chunks(downloader.iter_chunks(regions_to_parse, ['region']), args.fig_location,
+                             args.show_figure)
+    else:
+        parsed_data = downloader.get_list(regions_to_parse)
+        print(f'Data were successfully parsed. Preparing plots...')
+        with instrumentation.span('plot'):
+            plot_stat(parsed_data, args.fig_location, args.show_figure)
+    if args.report:
+        instrumentation.dump(args.report)
@@ -0,0 +1,103 @@
+import json
+import re
+import subprocess
+import sys
+
+from argparse import ArgumentParser
+from os import path
+
+# modules used as entry points of scripts, notebooks and services
+ENTRY_POINTS = ['download', 'get_stat', 'analysis', 'doc', 'geo', 'service', 'build']
+# timings recorded by --save_baseline, import time is tracked against them by --check,
+# absolute timings depend on machine, so baseline is recorded locally and it is not part of repository
+BASELINE_FILE = path.join(path.dirname(path.abspath(__file__)), 'import_baseline.json')
+
+
+def measure_import_time(module, repeat=1):
+    """Import module in fresh interpreter with -X importtime and return cumulative time in microseconds"""
+    # minimum of repeated runs is used, it is least affected by other load of machine
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise ImportError(f'Could not import {module}: {result.stderr.strip().splitlines()[-1]}')
+        timings.append(_parse_import_time(module, result.stderr))
+    return min(timings)
+
+
+def _parse_import_time(module, report):
+    """Get cumulative time of module from report of -X importtime"""
+    # last line of report corresponds to module itself, columns are: self [us] | cumulative | name
+    for line in reversed(report.splitlines()):
+        match = re.match(r'import time:\s*\d+\s*\|\s*(\d+)\s*\|\s*(\S+)', line)
+        if match and match.group(2) == module:
+            return int(match.group(1))
+    raise ValueError(f'Could not find import time of {module}')
+
+
+def measure_entry_points(modules=None, repeat=1):
+    """Measure import time of all provided modules, modules which could not be imported are reported as None"""
+    timings = {}
+    for module in modules or ENTRY_POINTS:
+        try:
+            timings[module] = measure_import_time(module, repeat)
+        except ImportError as error:
+            print(error, file=sys.stderr)
+            timings[module] = None
+    return timings
+
+
+def compare_with_baseline(timings, baseline, tolerance):
+    """Get list of tuple(module, time, baseline time) of modules slower than baseline by more than tolerance"""
+    regressions = []
+    for module, value in timings.items():
+        baseline_value = baseline.get(module)
+        if value is None or baseline_value is None:
+            continue
+        if value > baseline_value * (1 + tolerance):
+            regressions.append((module, value, baseline_value))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark import time of entry point modules.')
+    parser.add_argument('modules', nargs='*', help='modules to measure, all entry points by default')
+    parser.add_argument('--output', type=str, help='path where to save json with timings in microseconds')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of every import, minimum is used')
+    parser.add_argument('--baseline', type=str, default=BASELINE_FILE, help='path of json with baseline timings')
+    parser.add_argument('--save_baseline', action="store_true", help='save measured timings as new baseline')
+    parser.add_argument('--check', action="store_true",
+                        help='exit with error if any module is slower than baseline by more than tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed relative slowdown against baseline, 0.5 means 50 %%')
+    args = parser.parse_args()
+    import_timings = measure_entry_points(args.modules, args.repeat)
+
+    baseline_timings = {}
+    if path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            baseline_timings = json.load(file)
+    for name, value in import_timings.items():
+        line = f'{name:<10} {"-" if value is None else f"{value / 1000:.1f} ms":>10}'
+        if name in baseline_timings:
+            line += f' (baseline {baseline_timings[name] / 1000:.1f} ms)'
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(import_timings, file, indent=2)
+    if args.save_baseline:
+        # modules which were not measured keep their previous baseline
+        baseline_timings.update({name: value for name, value in import_timings.items() if value is not None})
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline_timings, file, indent=2)
+    if args.check:
+        if not baseline_timings:
+            raise OSError(f'Could not find baseline: {args.baseline}, record it on this machine by --save_baseline')
+        slow_modules = compare_with_baseline(import_timings, baseline_timings, args.tolerance)
+        for name, value, baseline_value in slow_modules:
+            print(f'{name} import is slower than baseline: {value / 1000:.1f} ms > {baseline_value / 1000:.1f} ms',
+                  file=sys.stderr)
+        if slow_modules:
+            sys.exit(1)
@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class PrimaryKeyIndex:
+    """Sorted index from accident identification number p1 to row position"""
+
+    def __init__(self, keys, positions):
+        """Init method expects keys sorted in ascending order and positions of rows corresponding to them"""
+        self.keys = keys
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def build(ids):
+        """Build index from column p1"""
+        positions = np.argsort(ids, kind='stable')
+        return PrimaryKeyIndex(ids[positions], positions.astype('i8'))
+
+    @staticmethod
+    def load(filename):
+        """Load index saved by save method"""
+        with np.load(filename) as data:
+            return PrimaryKeyIndex(data['keys'], data['positions'])
+
+    @staticmethod
+    def merge(indices):
+        """Merge indices of consecutive parts of data to one index, positions are shifted by length of previous parts"""
+        offset = 0
+        keys = []
+        positions = []
+        for index in indices:
+            keys.append(index.keys)
+            positions.append(index.positions + offset)
+            offset += len(index)
+        if not keys:
+            return PrimaryKeyIndex(np.ndarray(shape=(0,), dtype='i8'), np.ndarray(shape=(0,), dtype='i8'))
+        keys = np.concatenate(keys)
+        positions = np.concatenate(positions)
+        order = np.argsort(keys, kind='stable')
+        return PrimaryKeyIndex(keys[order], positions[order])
+
+    """Public methods"""
+
+    def save(self, filename):
+        """Save index to provided file in npz format"""
+        with open(filename, 'wb') as file:
+            np.savez(file, keys=self.keys, positions=self.positions)
+
+    def lookup(self, ids):
+        """Get row positions of provided ids, -1 for ids that are not in index"""
+        ids = np.asarray(ids, dtype=self.keys.dtype)
+        found = np.searchsorted(self.keys, ids)
+        # clip to valid range, ids bigger than all keys are detected by comparison below
+        found_clipped = np.minimum(found, max(len(self.keys) - 1, 0))
+        result = np.full(ids.shape, -1, dtype='i8')
+        if len(self.keys) > 0:
+            mask = self.keys[found_clipped] == ids
+            result[mask] = self.positions[found_clipped[mask]]
+        return result
+
+    def contains(self, ids):
+        """Get mask of provided ids that are present in index"""
+        return self.lookup(ids) >= 0
+
+    def duplicates(self):
+        """Get ids which are present more than once"""
+        mask = self.keys[1:] == self.keys[:-1]
+        return np.unique(self.keys[1:][mask])
+
+    def duplicate_positions(self):
+        """Get positions of rows whose id already occurred in row with lower position"""
+        mask = np.zeros(len(self.keys), dtype=bool)
+        mask[1:] = self.keys[1:] == self.keys[:-1]
+        # sort is stable so first occurrence of id has lowest position
+        return np.sort(self.positions[mask])
+
+    def join(self, ids, values, fill_value=None):
+        """Align external values identified by ids to rows of indexed data, missing rows get fill_value"""
+        values = np.asarray(values)
+        positions = self.lookup(ids)
+        mask = positions >= 0
+        if fill_value is None:
+            fill_value = np.nan if values.dtype.kind == 'f' else -1
+        result = np.full(len(self.keys), fill_value, dtype=values.dtype)
+        result[positions[mask]] = values[mask]
+        return result
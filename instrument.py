@@ -0,0 +1,102 @@
+import json
+
+from contextlib import contextmanager
+from time import perf_counter
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:
+    # resource module is available only on unix systems
+    getrusage = None
+
+
+def _get_peak_rss():
+    """Get peak resident set size of current process in bytes, None if it could not be sampled"""
+    if getrusage is None:
+        return None
+    # linux reports value in kilobytes
+    return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _NullSpan:
+    """Reusable context manager that does nothing, used when instrumentation is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class Instrumentation:
+    """Collect stage timings, counters and peak memory of data processing, disabled instance costs near zero"""
+
+    _null_span = _NullSpan()
+
+    def __init__(self, enabled=True):
+        """Init method creates empty containers for spans and counters"""
+        self.enabled = enabled
+        self.spans = {}
+        self.counters = {}
+        self.peak_rss = None
+        self.hooks = []
+
+    """Public methods"""
+
+    def span(self, name):
+        """Context manager measuring time and peak memory of stage with provided name"""
+        if not self.enabled:
+            return Instrumentation._null_span
+        return self.__measure(name)
+
+    def count(self, name, value=1):
+        """Increment counter with provided name by value"""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_hook(self, hook):
+        """Register callable hook(name, duration) called after every finished span"""
+        self.hooks.append(hook)
+
+    def sample_memory(self):
+        """Sample peak resident set size of process"""
+        if self.enabled:
+            rss = _get_peak_rss()
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def report(self):
+        """Get collected values as json serializable dictionary"""
+        self.sample_memory()
+        return {
+            'spans': {name: dict(values) for name, values in self.spans.items()},
+            'counters': dict(self.counters),
+            'peak_rss_bytes': self.peak_rss,
+        }
+
+    def dump(self, filename):
+        """Write report to provided file in json format"""
+        with open(filename, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    """Private methods"""
+
+    @contextmanager
+    def __measure(self, name):
+        """Measure wall time of stage and store it to spans"""
+        start = perf_counter()
+        try:
+            yield self
+        finally:
+            duration = perf_counter() - start
+            span = self.spans.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            span['calls'] += 1
+            span['seconds'] += duration
+            self.sample_memory()
+            span['peak_rss_bytes'] = self.peak_rss
+            for hook in self.hooks:
+                hook(name, duration)
+
+
+# shared disabled instance used as default value
+DISABLED = Instrumentation(enabled=False)
@@ -0,0 +1,94 @@
+import os
+
+from socket import gethostname
+from time import time
+
+
+def get_owner():
+    """Get identifier of current process which is unique across hosts"""
+    return f'{gethostname()}-{os.getpid()}'
+
+
+def claim_lease(filename, timeout):
+    """Try to create lease file atomically, lease older than timeout seconds is reclaimed, returns success"""
+    for _ in range(2):
+        try:
+            descriptor = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not _reclaim_stale_lease(filename, timeout):
+                return False
+            continue
+        with os.fdopen(descriptor, 'w') as file:
+            file.write(get_owner())
+        return True
+    return False
+
+
+def get_lease_owner(filename):
+    """Get owner written in lease file, None if lease does not exist"""
+    try:
+        with open(filename, 'r') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def touch_lease(filename):
+    """Renew lease, so other workers do not consider it stale, returns whether lease is still owned"""
+    if get_lease_owner(filename) != get_owner():
+        return False
+    try:
+        os.utime(filename, None)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def release_lease(filename):
+    """Remove lease file if it is owned by current process, lease claimed by other worker is kept"""
+    if get_lease_owner(filename) != get_owner():
+        return
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+def replace_atomically(filename, write):
+    """Call write(file_path) on temporary file in same folder and rename it to filename, readers see whole file"""
+    # temporary file is hidden, so it is not matched by patterns of cache files or datasets
+    folder, name = os.path.split(filename)
+    temporary_filename = os.path.join(folder, f'.{name}.tmp-{get_owner()}')
+    try:
+        write(temporary_filename)
+        os.replace(temporary_filename, filename)
+    finally:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+
+
+def _reclaim_stale_lease(filename, timeout):
+    """Remove lease which was not renewed for timeout seconds, returns whether lease could be claimed again"""
+    try:
+        status = os.stat(filename)
+        if time() - status.st_mtime < timeout:
+            return False
+        # rename is atomic, so lease file is moved away by exactly one worker
+        stale_filename = f'{filename}.stale-{get_owner()}'
+        os.rename(filename, stale_filename)
+    except FileNotFoundError:
+        # lease was released or reclaimed in the meantime, try to claim it again
+        return True
+    stale_status = os.stat(stale_filename)
+    if (stale_status.st_ino, stale_status.st_mtime) != (status.st_ino, status.st_mtime):
+        # stale lease was replaced by fresh lease of other worker before rename, so fresh lease is returned back,
+        # if third worker claimed lease in the meantime, both hold it until owner of moved lease finds out
+        # by owner check in touch_lease, release_lease never removes lease of other worker
+        try:
+            os.link(stale_filename, filename)
+        except FileExistsError:
+            pass
+        os.remove(stale_filename)
+        return False
+    os.remove(stale_filename)
+    return True
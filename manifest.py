@@ -0,0 +1,98 @@
+import json
+import numpy as np
+
+from hashlib import sha256
+
+
+def get_file_hash(filename):
+    """Get sha256 hash of file content"""
+    file_hash = sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _to_json_value(value):
+    """Convert numpy scalar to value which could be stored in json"""
+    if isinstance(value, np.datetime64):
+        return str(value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def _get_column_stats(column):
+    """Get zone map of column, nan values are ignored"""
+    if column.dtype.kind == 'f':
+        column = column[~np.isnan(column)]
+    if len(column) == 0:
+        return {'min': None, 'max': None, 'distinct': 0}
+    unique = np.unique(column)
+    return {'min': _to_json_value(unique[0]), 'max': _to_json_value(unique[-1]), 'distinct': len(unique)}
+
+
+def create_manifest(region, labels, values, sources=None):
+    """Create manifest of region partitioned by years, sources is list of tuple(archive, hash, rows) in order of rows"""
+    years = values[labels.index('year')]
+    # sources are not known for regions read from cache files created by older versions
+    sources = sources or []
+    source_indices = np.repeat(np.arange(len(sources)), [rows for _, _, rows in sources]).astype('i8')
+    if len(source_indices) != len(years):
+        sources = []
+        source_indices = np.full(shape=len(years), fill_value=-1, dtype='i8')
+    partitions = {}
+    for year in np.unique(years):
+        mask = years == year
+        partitions[str(year)] = {
+            'rows': int(np.count_nonzero(mask)),
+            'bytes': int(sum(value.itemsize * np.count_nonzero(mask) for value in values)),
+            'sources': [{'archive': sources[index][0], 'hash': sources[index][1]}
+                        for index in np.unique(source_indices[mask]) if index >= 0],
+            'columns': {label: _get_column_stats(value[mask]) for label, value in zip(labels, values)},
+        }
+    return {'region': region, 'partitions': partitions}
+
+
+def load_manifest(filename):
+    """Load manifest from json file"""
+    with open(filename, 'r') as file:
+        return json.load(file)
+
+
+def save_manifest(manifest, filename):
+    """Save manifest to json file"""
+    with open(filename, 'w') as file:
+        json.dump(manifest, file, indent=1)
+
+
+def _compare_value(value, stats_value):
+    """Convert value to type comparable with value stored in manifest"""
+    if isinstance(stats_value, str) and not isinstance(value, str):
+        return str(np.datetime64(value, 'D')) if isinstance(value, np.datetime64) else str(value)
+    return value
+
+
+def partition_may_match(partition, filters):
+    """Check by zone maps if partition could contain rows matching filters"""
+    # value is compared for equality, list for membership and dict with keys min and max for range
+    for column, value in (filters or {}).items():
+        stats = partition['columns'].get(column)
+        if stats is None:
+            continue
+        low, high = stats['min'], stats['max']
+        if low is None:
+            return False
+        if isinstance(value, dict):
+            if 'min' in value and _compare_value(value['min'], high) > high:
+                return False
+            if 'max' in value and _compare_value(value['max'], low) < low:
+                return False
+        elif isinstance(value, list):
+            if not any(low <= _compare_value(item, low) <= high for item in value):
+                return False
+        elif not low <= _compare_value(value, low) <= high:
+            return False
+    return True
@@ -0,0 +1,337 @@
+import json
+import numpy as np
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from io import BytesIO
+from os import path, close, remove as remove_file
+from tempfile import mkstemp
+from threading import Condition, Lock
+from urllib.request import Request, urlopen
+from download import DataDownloader
+
+
+class _ReadWriteLock:
+    """Lock allowing many concurrent readers or single writer"""
+
+    def __init__(self):
+        self.condition = Condition(Lock())
+        self.readers = 0
+        self.writing = False
+
+    def acquire_read(self):
+        with self.condition:
+            while self.writing:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.condition:
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        with self.condition:
+            while self.writing or self.readers > 0:
+                self.condition.wait()
+            self.writing = True
+
+    def release_write(self):
+        with self.condition:
+            self.writing = False
+            self.condition.notify_all()
+
+
+class _ThreadPoolHTTPServer(HTTPServer):
+    """HTTP server handling requests in fixed size thread pool"""
+
+    def __init__(self, server_address, handler_class, workers):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        """Hand request over to thread pool"""
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        """Same as socketserver.ThreadingMixIn.process_request_thread"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class QueryService:
+    """Keep parsed accident data resident in memory and answer queries about them"""
+
+    figures = ['stat', 'conseq', 'surface']
+
+    def __init__(self, downloader=None, regions=None):
+        """Init method loads data of selected regions, all regions are loaded by default"""
+        self.downloader = downloader or DataDownloader()
+        self.regions = regions
+        self.lock = _ReadWriteLock()
+        # refreshes are done by single writer thread, so downloader is never used concurrently
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        # matplotlib is not thread safe, figures are rendered one by one
+        self.figure_lock = Lock()
+        self.labels, self.values = self.downloader.get_list(regions)
+
+    """Public methods"""
+
+    def refresh(self):
+        """Reload data in writer thread and swap them, returns number of rows"""
+        return self.writer.submit(self.__refresh).result()
+
+    def status(self):
+        """Get number of rows and list of labels of resident data"""
+        labels, values = self.__snapshot()
+        return {'rows': int(len(values[0])) if values else 0, 'labels': labels}
+
+    def count(self, filters=None):
+        """Count rows matching provided filters"""
+        labels, values = self.__snapshot()
+        return int(np.count_nonzero(DataDownloader.get_filter_mask(labels, values, filters)))
+
+    def group(self, group_by, filters=None):
+        """Count rows matching provided filters grouped by provided columns as list[dict]"""
+        labels, values = self.__snapshot()
+        mask = DataDownloader.get_filter_mask(labels, values, filters)
+        if not group_by:
+            return [{'count': int(np.count_nonzero(mask))}]
+        uniques = []
+        inverses = []
+        for column in group_by:
+            unique, inverse = np.unique(self.__get_column(labels, values, column)[mask], return_inverse=True)
+            uniques.append(unique)
+            inverses.append(inverse)
+        # combine indices of each column to single group key
+        keys = np.ravel_multi_index(inverses, [len(unique) for unique in uniques])
+        groups, counts = np.unique(keys, return_counts=True)
+        result = []
+        for group, count in zip(groups, counts):
+            indices = np.unravel_index(group, [len(unique) for unique in uniques])
+            item = {column: uniques[i][index].item() for i, (column, index) in enumerate(zip(group_by, indices))}
+            item['count'] = int(count)
+            result.append(item)
+        return result
+
+    def columns(self, columns=None, filters=None):
+        """Get selected columns of rows matching provided filters as dict[str, np.ndarray]"""
+        labels, values = self.__snapshot()
+        mask = DataDownloader.get_filter_mask(labels, values, filters)
+        return {column: self.__get_column(labels, values, column)[mask] for column in columns or labels}
+
+    def figure(self, name):
+        """Render figure with provided name to png and return its content"""
+        if name not in QueryService.figures:
+            raise ValueError(f'Provided figure {name} does not exist')
+        import matplotlib
+        matplotlib.use('Agg')
+        from matplotlib import pyplot as plt
+        import get_stat
+        import analysis
+
+        labels, values = self.__snapshot()
+        handle, filename = mkstemp(suffix='.png')
+        close(handle)
+        try:
+            with self.figure_lock:
+                if name == 'stat':
+                    get_stat.plot_stat((labels, values), filename)
+                elif name == 'conseq':
+                    analysis.plot_conseq_chunks(self.__chunks(labels, values), filename)
+                else:
+                    analysis.plot_surface_chunks(self.__chunks(labels, values), filename)
+                plt.close('all')
+            with open(filename, 'rb') as file:
+                return file.read()
+        finally:
+            remove_file(filename)
+
+    """Private methods"""
+
+    def __refresh(self):
+        """Get fresh data from downloader and swap them under write lock"""
+        # drop data held by downloader, so actual caches are read again
+        self.downloader.clear_parsed_data()
+        self.downloader.non_duplicate_datasets = None
+        labels, values = self.downloader.get_list(self.regions)
+        self.lock.acquire_write()
+        try:
+            self.labels, self.values = labels, values
+        finally:
+            self.lock.release_write()
+        return len(values[0]) if values else 0
+
+    def __snapshot(self):
+        """Get references to actual data, data are never modified in place so they can be read without lock"""
+        self.lock.acquire_read()
+        try:
+            return self.labels, self.values
+        finally:
+            self.lock.release_read()
+
+    @staticmethod
+    def __get_column(labels, values, column):
+        """Get column by label"""
+        if column not in labels:
+            raise ValueError(f'Provided column {column} does not exist')
+        return values[labels.index(column)]
+
+    @staticmethod
+    def __chunks(labels, values):
+        """Iterate over resident data by regions and years same as DataDownloader.iter_chunks"""
+        regions = values[labels.index('region')]
+        years = values[labels.index('year')]
+        for region in np.unique(regions):
+            region_mask = regions == region
+            for year in np.unique(years[region_mask]):
+                mask = region_mask & (years == year)
+                yield str(region), int(year), {label: values[index][mask] for index, label in enumerate(labels)}
+
+
+def _json_default(value):
+    """Serialize numpy values which are not supported by json module"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def create_server(service, host='127.0.0.1', port=8765, workers=8):
+    """Create http server answering queries of provided service"""
+
+    class Handler(BaseHTTPRequestHandler):
+        """Route requests to QueryService methods"""
+
+        def do_GET(self):
+            if self.path == '/status':
+                self.__send_json(service.status())
+            elif self.path.startswith('/figure/'):
+                self.__handle(lambda: self.__send(service.figure(self.path[len('/figure/'):]), 'image/png'))
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            self.__handle(self.__post)
+
+        def log_message(self, message_format, *args):
+            """Do not log every request"""
+
+        def __post(self):
+            """Decode json body and route request, invalid body is reported as bad request"""
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(body, dict):
+                raise ValueError('Provided body is not json object')
+            if self.path == '/count':
+                self.__send_json({'count': service.count(body.get('filters'))})
+            elif self.path == '/group':
+                self.__send_json(service.group(body['group_by'], body.get('filters')))
+            elif self.path == '/columns':
+                self.__send_columns(service.columns(body.get('columns'), body.get('filters')))
+            elif self.path == '/refresh':
+                self.__send_json({'rows': service.refresh()})
+            else:
+                self.send_error(404)
+
+        def __handle(self, action):
+            """Run action, report invalid queries as bad request and other errors as server error"""
+            try:
+                action()
+            except (ValueError, KeyError, TypeError, IndexError, OverflowError) as error:
+                # json decode errors and comparisons of values with columns of other type are invalid queries
+                self.send_error(400, str(error))
+            except Exception as error:
+                self.send_error(500, str(error))
+
+        def __send_json(self, content):
+            self.__send(json.dumps(content, default=_json_default).encode(), 'application/json')
+
+        def __send_columns(self, columns):
+            buffer = BytesIO()
+            np.savez(buffer, **columns)
+            self.__send(buffer.getvalue(), 'application/octet-stream')
+
+        def __send(self, content, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return _ThreadPoolHTTPServer((host, port), Handler, workers)
+
+
+class ServiceClient:
+    """Thin client for QueryService running on local http server"""
+
+    def __init__(self, host='127.0.0.1', port=8765):
+        self.url = f'http://{host}:{port}'
+
+    def status(self):
+        """Get number of rows and labels of resident data"""
+        return json.loads(self.__request('/status'))
+
+    def count(self, filters=None):
+        """Count rows matching provided filters"""
+        return json.loads(self.__request('/count', {'filters': filters}))['count']
+
+    def group(self, group_by, filters=None):
+        """Count rows matching provided filters grouped by provided columns"""
+        return json.loads(self.__request('/group', {'group_by': group_by, 'filters': filters}))
+
+    def columns(self, columns=None, filters=None):
+        """Get selected columns of rows matching provided filters as dict[str, np.ndarray]"""
+        content = self.__request('/columns', {'columns': columns, 'filters': filters})
+        with np.load(BytesIO(content)) as data:
+            return {column: data[column] for column in data.files}
+
+    def dataframe(self, columns=None, filters=None):
+        """Get selected columns of rows matching provided filters as pd.DataFrame"""
+        import pandas as pd
+        return pd.DataFrame(self.columns(columns, filters))
+
+    def figure(self, name, fig_location):
+        """Save figure rendered by service to provided location"""
+        with open(fig_location, 'wb') as file:
+            file.write(self.__request(f'/figure/{name}'))
+
+    def refresh(self):
+        """Reload data in service, returns number of rows"""
+        return json.loads(self.__request('/refresh', {}))['rows']
+
+    def __request(self, route, body=None):
+        """Send request to service and return content of response"""
+        data = None if body is None else json.dumps(body, default=_json_default).encode()
+        request = Request(f'{self.url}{route}', data=data, headers={'Content-Type': 'application/json'})
+        with urlopen(request) as response:
+            return response.read()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Local service keeping parsed data in memory.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    parser.add_argument('--workers', type=int, default=8, help='number of threads serving requests')
+    parser.add_argument('--folder', type=str, default='data', help='folder with datasets and cache files')
+    parser.add_argument('--offline', action="store_true", help='use only local datasets and cache files')
+    args = parser.parse_args()
+    print(f'Loading data from {path.abspath(args.folder)}...')
+    query_service = QueryService(DataDownloader(folder=args.folder, offline=args.offline))
+    server = create_server(query_service, args.host, args.port, args.workers)
+    print(f'Serving on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()